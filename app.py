@@ -7,12 +7,19 @@ import json
 from PIL import Image
 import shutil
 import tempfile
+import time
+import uuid
 from dotenv import load_dotenv
 from google.oauth2 import service_account
 
 # Importa le funzioni dal file principale
 # Assicurati che il file principale si chiami main.py e sia nella stessa directory
-from main import analyze_text_sentiment, analyze_face_expression, transcribe_audio
+from main import analyze_text_sentiment, analyze_face_expression, estimate_irony_score, irony_score_label
+from task_queue import FairTaskExecutor, QueueSaturatedError, STATUS_ERROR, STATUS_QUEUED
+from transcription_jobs import TranscriptionJobManager
+from job_store import STATUS_RUNNING
+from results import FaceResult
+from history import HistoryStore, input_digest
 
 st.set_page_config(
     page_title="Analizzatore di Sentiment e Ironia", 
@@ -186,28 +193,12 @@ def plot_sentiment_gauge(score, title="Sentiment Score"):
 
 # Funzione per visualizzare le emozioni dalle espressioni facciali
 def plot_emotions(emotions):
-    if "error" in emotions:
+    face = FaceResult.from_dict(emotions)
+    if face.error is not None:
         return None
     
-    # Mapping dei valori di likelihood a numeri
-    likelihood_mapping = {
-        "UNKNOWN": 0,
-        "VERY_UNLIKELY": 1,
-        "UNLIKELY": 2,
-        "POSSIBLE": 3,
-        "LIKELY": 4,
-        "VERY_LIKELY": 5
-    }
-    
-    # Estrai i valori numerici delle emozioni
-    emotion_values = {}
-    for emotion, likelihood in emotions.items():
-        if emotion != "detection_confidence":
-            if likelihood in likelihood_mapping:
-                emotion_values[emotion] = likelihood_mapping[likelihood]
-    
-    if not emotion_values:
-        return None
+    # Likelihood già come interi da 0 (UNKNOWN) a 5 (VERY_LIKELY)
+    emotion_values = face.likelihoods()
     
     # Crea il grafico a barre
     fig, ax = plt.subplots(figsize=(8, 3))
@@ -237,6 +228,211 @@ def plot_emotions(emotions):
     
     return fig
 
+# Sentiment medio per giorno e modalità, dai totali giornalieri dello storico
+def plot_history(daily):
+    series = {}
+    for rollup in daily:
+        if rollup["avg_score"] is not None:
+            series.setdefault(rollup["modality"], []).append((rollup["day"], rollup["avg_score"]))
+    if not series:
+        return None
+    
+    fig, ax = plt.subplots(figsize=(8, 3))
+    labels = {"text": "Testo", "audio": "Trascrizione"}
+    for modality, points in series.items():
+        days, scores = zip(*points)
+        ax.plot(days, scores, marker="o", label=labels.get(modality, modality))
+    
+    ax.axhline(0, color="lightgrey", linewidth=1)
+    ax.set_ylim(-1.05, 1.05)
+    ax.set_title("Sentiment medio giornaliero")
+    ax.legend()
+    fig.autofmt_xdate()
+    plt.tight_layout()
+    
+    return fig
+
+# Limiti dell'executor condiviso da tutte le sessioni
+MAX_WORKERS = 8
+API_LIMITS = {"language": 4, "vision": 4, "speech": 2}
+MAX_QUEUED = 50
+MAX_QUEUED_PER_SESSION = 3
+POLL_INTERVAL = 1.0
+TRANSCRIPTION_POLL_INTERVAL = 5
+
+# Executor unico per il processo: le analisi girano in background e l'interfaccia resta reattiva
+@st.cache_resource
+def get_executor():
+    return FairTaskExecutor(
+        max_workers=MAX_WORKERS,
+        api_limits=API_LIMITS,
+        max_queued=MAX_QUEUED,
+        max_queued_per_session=MAX_QUEUED_PER_SESSION
+    )
+
+# Job di trascrizione condivisi da tutte le sessioni: un solo thread raccoglie le operazioni
+# completate (e le salva nello storico), senza tenere occupati i worker dell'executor
+@st.cache_resource
+def get_transcription_manager():
+    return TranscriptionJobManager(history=get_history(), source="app",
+                                   poll_interval=TRANSCRIPTION_POLL_INTERVAL).start()
+
+# Prepara e carica l'audio e avvia la trascrizione, senza attenderne la fine
+def start_audio_job(audio_path, language_code):
+    return get_transcription_manager().submit(audio_path, language_code)
+
+# Storico locale delle analisi, condiviso da tutte le sessioni
+@st.cache_resource
+def get_history():
+    return HistoryStore()
+
+# Esegue un'analisi e la registra nello storico (gira nei thread dell'executor)
+def run_and_record(history, kind, func, *args):
+    started_at = time.time()
+    result = func(*args)
+    # Le trascrizioni vengono registrate dal gestore dei job quando terminano
+    if kind not in ('text', 'image'):
+        return result
+    try:
+        history.record(kind, input_digest(kind, args[0]), result, "app", started_at=started_at)
+    except Exception as e:
+        print(f"⚠️ Impossibile aggiornare lo storico: {e}")
+    return result
+
+# Mostra lo storico delle analisi senza riscandire le esecuzioni né richiamare le API
+def show_history(history):
+    summary = history.summary()
+    if not summary["runs"]:
+        st.info("Nessuna analisi nello storico")
+        return
+    
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Analisi registrate", summary["runs"])
+    col2.metric("Sentiment medio", f"{summary['avg_score']:.2f}" if summary["avg_score"] is not None else "N/A")
+    col3.metric("Tasso di ironia", f"{summary['irony_rate']:.0%}" if summary["irony_rate"] is not None else "N/A")
+    
+    history_fig = plot_history(history.daily())
+    if history_fig:
+        st.pyplot(history_fig)
+    
+    emotions = history.summary("image")["emotions"]
+    if emotions["joy"] is not None:
+        st.markdown(f"""
+        **Volti con emozione probabile:**
+        - 😊 Gioia: {emotions['joy']:.0%}
+        - 😢 Tristezza: {emotions['sorrow']:.0%}
+        - 😠 Rabbia: {emotions['anger']:.0%}
+        - 😲 Sorpresa: {emotions['surprise']:.0%}
+        """)
+    
+    st.dataframe([
+        {
+            "Data": time.strftime("%Y-%m-%d %H:%M", time.localtime(run["finished_at"])),
+            "Modalità": run["modality"],
+            "Fonte": run["source"],
+            "Score": run["score"],
+            "Ironia": None if run["irony"] is None else bool(run["irony"]),
+            "Errore": run["result"].get("error", "")
+        }
+        for run in history.recent(10)
+    ])
+
+# Mette in coda un'analisi per la sessione corrente
+def submit_analysis(kind, api, func, *args):
+    pending = st.session_state.setdefault('pending_tasks', {})
+    if kind in pending or (kind == 'audio' and 'audio_job' in st.session_state):
+        st.warning("⏳ Un'analisi dello stesso tipo è già in corso")
+        return False
+    try:
+        pending[kind] = get_executor().submit(st.session_state['session_id'], api, run_and_record,
+                                              get_history(), kind, func, *args)
+        return True
+    except QueueSaturatedError as e:
+        st.error(f"❌ {e}")
+        return False
+
+# Ritira i risultati delle analisi terminate e li salva nella sessione
+def collect_finished_analyses():
+    executor = get_executor()
+    finished = {}
+    for kind, task_id in list(st.session_state.get('pending_tasks', {}).items()):
+        task = executor.poll(task_id)
+        if task is None:
+            # Task perso (es. riavvio del server)
+            del st.session_state['pending_tasks'][kind]
+            continue
+        if not task.finished:
+            continue
+        executor.pop_finished(task_id)
+        del st.session_state['pending_tasks'][kind]
+        
+        result = task.result if task.status != STATUS_ERROR else {"error": task.error}
+        if kind == 'audio' and task.status != STATUS_ERROR:
+            # Il task ha solo avviato la trascrizione: il risultato arriva dal job
+            st.session_state['audio_job'] = result
+            continue
+        if kind == 'audio_sentiment':
+            st.session_state['audio_sentiment'] = result if "error" not in result else None
+            continue
+        st.session_state[f'{kind}_results'] = result
+        finished[kind] = result
+    
+    collect_transcription_job(finished)
+    return finished
+
+# Controlla il job di trascrizione della sessione e, se terminato, ne salva il risultato
+def collect_transcription_job(finished):
+    job_id = st.session_state.get('audio_job')
+    if job_id is None:
+        return
+    manager = get_transcription_manager()
+    status = manager.status(job_id)
+    if status == STATUS_RUNNING:
+        return
+    del st.session_state['audio_job']
+    
+    result = manager.result(job_id) if status is not None else {"error": "Job di trascrizione non trovato"}
+    st.session_state['audio_results'] = result
+    st.session_state['audio_sentiment'] = None
+    finished['audio'] = result
+    if "error" not in result and result.get('transcript'):
+        # Il sentiment della trascrizione viene calcolato una sola volta, in background
+        submit_analysis('audio_sentiment', 'language', analyze_transcript, manager, job_id, result['transcript'])
+
+# Sentiment della trascrizione di un job, aggiunto anche all'esecuzione salvata nello storico
+def analyze_transcript(manager, job_id, transcript):
+    sentiment = analyze_text_sentiment(transcript, True)
+    manager.record_sentiment(job_id, sentiment)
+    return sentiment
+
+# Analisi in coda o in esecuzione per la sessione, compresa la trascrizione in corso
+def pending_analyses():
+    return len(st.session_state.get('pending_tasks', {})) + ('audio_job' in st.session_state)
+
+# Mostra lo stato di un'analisi in coda o in esecuzione
+def show_pending_analysis(kind, label):
+    if kind == 'audio' and 'audio_job' in st.session_state:
+        st.info("⏳ Trascrizione in corso, il risultato apparirà appena pronto...")
+        return
+    task_id = st.session_state.get('pending_tasks', {}).get(kind)
+    task = get_executor().poll(task_id) if task_id else None
+    if task is None or task.finished:
+        return
+    if task.status == STATUS_QUEUED:
+        position = get_executor().position(task_id)
+        st.info(f"🕒 {label} in coda" + (f" (circa {position} richieste prima di questa)" if position else ""))
+    else:
+        st.info(f"⏳ {label} in corso da {time.time() - task.started_at:.0f} secondi...")
+
+# Mostra l'esito di un'analisi appena terminata
+def show_finished_analysis(finished, kind, success_message):
+    if kind not in finished:
+        return
+    if "error" in finished[kind]:
+        st.error(f"❌ {finished[kind]['error']}")
+    else:
+        st.success(success_message)
+
 # Funzione principale che viene eseguita quando l'app viene avviata
 def main():
     st.title("🎭 Analizzatore di Sentiment e Ironia")
@@ -276,6 +472,15 @@ def main():
     # Verifica la presenza dei file predefiniti
     default_files = check_default_files()
     
+    # Identificativo della sessione per la coda condivisa e raccolta dei risultati pronti
+    st.session_state.setdefault('session_id', uuid.uuid4().hex)
+    finished = collect_finished_analyses()
+    
+    depth = get_executor().queue_depth()
+    st.sidebar.header("📬 Coda analisi")
+    st.sidebar.metric("Richieste in coda", depth["queued"])
+    st.sidebar.metric("Analisi in esecuzione", depth["running"])
+    
     # Contenitore principale
     with st.container():
         # Tabs per diverse modalità di analisi
@@ -302,11 +507,11 @@ def main():
                 if not creds_path:
                     st.error("❌ File .env non trovato o variabili mancanti. Controlla la configurazione.")
                 else:
-                    with st.spinner("Analisi del testo in corso..."):
-                        text_results = analyze_text_sentiment(text_input)
-                        st.session_state['text_results'] = text_results
-                        st.session_state['text_input'] = text_input
-                        st.success("✅ Analisi del testo completata!")
+                    st.session_state['text_input'] = text_input
+                    submit_analysis('text', 'language', analyze_text_sentiment, text_input)
+            
+            show_pending_analysis('text', "Analisi del testo")
+            show_finished_analysis(finished, 'text', "✅ Analisi del testo completata!")
             
             # Se ci sono risultati, visualizzali
             if 'text_results' in st.session_state:
@@ -362,14 +567,11 @@ def main():
                 if not creds_path:
                     st.error("❌ File .env non trovato o variabili mancanti. Controlla la configurazione.")
                 else:
-                    with st.spinner("Analisi dell'immagine in corso..."):
-                        image_results = analyze_face_expression(image_path)
-                        st.session_state['image_results'] = image_results
-                        st.session_state['image_path'] = image_path
-                        if "error" not in image_results:
-                            st.success("✅ Analisi dell'immagine completata!")
-                        else:
-                            st.error(f"❌ {image_results['error']}")
+                    st.session_state['image_path'] = image_path
+                    submit_analysis('image', 'vision', analyze_face_expression, image_path)
+            
+            show_pending_analysis('image', "Analisi dell'immagine")
+            show_finished_analysis(finished, 'image', "✅ Analisi dell'immagine completata!")
             
             # Se ci sono risultati, visualizzali
             if 'image_results' in st.session_state and "error" not in st.session_state['image_results']:
@@ -439,14 +641,11 @@ def main():
                 if not creds_path:
                     st.error("❌ File .env non trovato o variabili mancanti. Controlla la configurazione.")
                 else:
-                    with st.spinner("Analisi dell'audio in corso..."):
-                        audio_results = transcribe_audio(audio_path, language_code)
-                        st.session_state['audio_results'] = audio_results
-                        st.session_state['audio_path'] = audio_path
-                        if "error" not in audio_results:
-                            st.success("✅ Analisi dell'audio completata!")
-                        else:
-                            st.error(f"❌ {audio_results['error']}")
+                    st.session_state['audio_path'] = audio_path
+                    submit_analysis('audio', 'speech', start_audio_job, audio_path, language_code)
+            
+            show_pending_analysis('audio', "Analisi dell'audio")
+            show_finished_analysis(finished, 'audio', "✅ Analisi dell'audio completata!")
             
             # Se ci sono risultati, visualizzali
             if 'audio_results' in st.session_state and "error" not in st.session_state['audio_results'] and st.session_state['audio_results'].get('transcript'):
@@ -463,10 +662,9 @@ def main():
                 if "note" in st.session_state['audio_results']:
                     st.info(f"ℹ️ {st.session_state['audio_results']['note']}")
                 
-                # Analizza il sentiment della trascrizione
-                if st.session_state['audio_results']['transcript']:
-                    audio_sentiment = analyze_text_sentiment(st.session_state['audio_results']['transcript'])
-                    
+                # Sentiment della trascrizione, calcolato in background appena la trascrizione è pronta
+                audio_sentiment = st.session_state.get('audio_sentiment')
+                if audio_sentiment:
                     st.subheader("Sentiment della trascrizione")
                     
                     # Visualizza il sentiment score con un gauge
@@ -480,6 +678,12 @@ def main():
                     with col2:
                         st.metric("Ironia/Sarcasmo rilevato", 
                                   "Sì" if audio_sentiment['sarcasm_detected'] else "No")
+                    
+                    # Sentiment delle singole frasi della trascrizione
+                    if audio_sentiment.get('sentences'):
+                        with st.expander("Sentiment per frase"):
+                            for sentence in audio_sentiment['sentences']:
+                                st.markdown(f"`{sentence['score']:+.2f}` {sentence['text']}")
         
         # Tab per i risultati combinati
         with tabs[3]:
@@ -506,23 +710,22 @@ def main():
                 if not creds_path:
                     st.error("❌ File .env non trovato o variabili mancanti. Controlla la configurazione.")
                 else:
-                    with st.spinner("Analisi in corso..."):
-                        # Analisi del testo
-                        if 'text_input' in st.session_state and st.session_state['text_input']:
-                            text_results = analyze_text_sentiment(st.session_state['text_input'])
-                            st.session_state['text_results'] = text_results
-                        
-                        # Analisi dell'immagine
-                        if 'image_path' in st.session_state:
-                            image_results = analyze_face_expression(st.session_state['image_path'])
-                            st.session_state['image_results'] = image_results
-                        
-                        # Analisi dell'audio
-                        if 'audio_path' in st.session_state:
-                            audio_results = transcribe_audio(st.session_state['audio_path'], language_code)
-                            st.session_state['audio_results'] = audio_results
-                        
-                        st.success("✅ Analisi completa terminata!")
+                    # Analisi del testo
+                    if 'text_input' in st.session_state and st.session_state['text_input']:
+                        submit_analysis('text', 'language', analyze_text_sentiment, st.session_state['text_input'])
+                    
+                    # Analisi dell'immagine
+                    if 'image_path' in st.session_state:
+                        submit_analysis('image', 'vision', analyze_face_expression, st.session_state['image_path'])
+                    
+                    # Analisi dell'audio
+                    if 'audio_path' in st.session_state:
+                        submit_analysis('audio', 'speech', start_audio_job, st.session_state['audio_path'], language_code)
+            
+            if pending_analyses():
+                st.info(f"⏳ Analisi in corso: {pending_analyses()}")
+            elif finished:
+                st.success("✅ Analisi completa terminata!")
             
             # Visualizza i risultati in formato tabellare
             if any(k in st.session_state for k in ['text_results', 'image_results', 'audio_results']):
@@ -573,8 +776,8 @@ def main():
                         """
                         st.markdown(results_audio)
                         
-                        if st.session_state['audio_results'].get('transcript'):
-                            audio_sentiment = analyze_text_sentiment(st.session_state['audio_results']['transcript'])
+                        audio_sentiment = st.session_state.get('audio_sentiment')
+                        if audio_sentiment:
                             results_audio_sentiment = f"""
                             **Sentiment della trascrizione:**
                             - Score: {audio_sentiment['score']:.2f}
@@ -586,6 +789,21 @@ def main():
                         st.warning(f"Errore nell'analisi dell'audio: {st.session_state['audio_results']['error']}")
                 else:
                     st.info("Nessuna analisi dell'audio disponibile")
+                
+                # Stima dell'ironia che combina testo, volto e trascrizione
+                if 'text_results' in st.session_state:
+                    st.subheader("🧮 Fusione multimodale")
+                    irony_score = estimate_irony_score(
+                        st.session_state['text_results'],
+                        st.session_state.get('image_results'),
+                        st.session_state.get('audio_sentiment')
+                    )
+                    st.metric(irony_score_label(), f"{irony_score:.0%}")
+                    st.progress(irony_score)
+    
+            # Storico persistente delle analisi, anche delle sessioni precedenti
+            st.subheader("📚 Storico delle analisi")
+            show_history(get_history())
     
     # Informazioni aggiuntive nel footer
     st.markdown("---")
@@ -594,9 +812,16 @@ def main():
     - Questo strumento utilizza le API di Google Cloud per analizzare sentiment, ironia ed emozioni
     - Le credenziali vengono caricate automaticamente dal file .env nella stessa directory
     - I file predefiniti test.jpg e test.wav vengono utilizzati se presenti nella directory
-    - Per i file audio, vengono analizzati al massimo i primi 45 secondi in formato mono
+    - Per i file audio, il silenzio iniziale, finale e le pause lunghe vengono rimossi prima della trascrizione
+    - Ogni analisi viene salvata nello storico locale (history.db) insieme ai totali giornalieri
     - Il rilevamento dell'ironia è basato su euristiche e potrebbe non essere sempre accurato
     """)
+    
+    # Finché ci sono analisi in corso la pagina si aggiorna da sola per mostrarne lo stato
+    if pending_analyses():
+        time.sleep(POLL_INTERVAL)
+        rerun = getattr(st, "rerun", None) or st.experimental_rerun
+        rerun()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,82 @@
+import numpy as np
+
+# Analisi dei livelli audio con NumPy: individua i tratti di silenzio per non
+# caricare e far fatturare all'API Speech secondi che non contengono parlato.
+
+# Durata delle finestre su cui viene calcolato il livello RMS
+FRAME_MS = 20
+
+# Le finestre sotto questa soglia (dBFS) sono considerate silenzio
+SILENCE_THRESHOLD_DBFS = -45.0
+
+# Le pause interne più lunghe di così vengono accorciate a questa durata
+MAX_PAUSE_SECONDS = 1.0
+
+# Margine di audio mantenuto prima e dopo ogni tratto di parlato
+PADDING_MS = 200
+
+# Sotto questa quantità di parlato il file è considerato silenzioso
+MIN_VOICED_SECONDS = 0.25
+
+INT16_FULL_SCALE = 32768.0
+
+
+def frame_levels_dbfs(samples, frame_rate, frame_ms=FRAME_MS):
+    """Livello RMS in dBFS di ogni finestra di frame_ms millisecondi (campioni int16 mono)"""
+    frame_len = max(1, int(frame_rate * frame_ms / 1000))
+    n_frames = -(-len(samples) // frame_len)
+    padded = np.zeros(n_frames * frame_len, dtype=np.float32)
+    padded[:len(samples)] = samples
+    frames = padded.reshape(n_frames, frame_len) / INT16_FULL_SCALE
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    return 20 * np.log10(rms + 1e-10), frame_len
+
+
+def _dilate(mask, width):
+    """Estende ogni tratto True di width finestre a sinistra e a destra"""
+    if width <= 0 or not mask.any():
+        return mask
+    counts = np.convolve(mask.astype(np.int32), np.ones(2 * width + 1, dtype=np.int32), mode="same")
+    return counts > 0
+
+
+def trim_silence(samples, frame_rate, threshold_dbfs=SILENCE_THRESHOLD_DBFS, max_pause=MAX_PAUSE_SECONDS,
+                 padding_ms=PADDING_MS, min_voiced=MIN_VOICED_SECONDS, frame_ms=FRAME_MS):
+    """
+    Rimuove il silenzio iniziale e finale e accorcia le pause interne più lunghe
+    di max_pause secondi. Restituisce i campioni rimasti e un dizionario con le
+    durate originale e finale; se il parlato è inferiore a min_voiced secondi il
+    dizionario ha silent=True e i campioni restituiti sono vuoti.
+    """
+    levels, frame_len = frame_levels_dbfs(samples, frame_rate, frame_ms)
+    voiced = levels > threshold_dbfs
+    original_duration = len(samples) / frame_rate
+
+    info = {
+        "original_duration": original_duration,
+        "duration": original_duration,
+        "voiced_duration": float(voiced.sum() * frame_len / frame_rate),
+        "peak_dbfs": float(levels.max()) if len(levels) else float("-inf"),
+        "silent": False
+    }
+    if info["voiced_duration"] < min_voiced:
+        info["duration"] = 0.0
+        info["silent"] = True
+        return samples[:0], info
+
+    keep = _dilate(voiced, int(padding_ms / frame_ms))
+
+    # Tratti di silenzio interni: si tengono solo le prime max_pause secondi di ciascuno
+    first, last = np.flatnonzero(keep)[[0, -1]]
+    silent = ~keep
+    silent[:first] = False
+    silent[last + 1:] = False
+    indices = np.arange(len(keep))
+    run_start = np.where(silent & ~np.r_[False, silent[:-1]], indices, 0)
+    position_in_run = indices - np.maximum.accumulate(run_start)
+    keep |= silent & (position_in_run < int(max_pause * 1000 / frame_ms))
+
+    sample_mask = np.repeat(keep, frame_len)[:len(samples)]
+    trimmed = samples[sample_mask]
+    info["duration"] = len(trimmed) / frame_rate
+    return trimmed, info
@@ -0,0 +1,366 @@
+import os
+import io
+import sys
+import json
+import time
+import wave
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+import main
+import gcs_staging
+from local_storage import LocalStorageClient
+from google.cloud import language_v1
+from google.cloud import vision_v1 as vision
+from google.cloud import speech_v1 as speech
+
+# Benchmark dei percorsi CPU usati in produzione (downmix, preparazione audio,
+# caricamento immagini, euristiche sull'ironia, fusione) e della latenza
+# end-to-end di main() con i client Google sostituiti da finti client con
+# latenza configurabile. I risultati vengono confrontati con una baseline
+# salvata: un peggioramento oltre la tolleranza fa fallire l'esecuzione e, con
+# --check (per la CI), la fa fallire anche una baseline mancante o incompleta.
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# Peggioramento massimo tollerato rispetto alla baseline (p50 e throughput)
+DEFAULT_TOLERANCE = 0.25
+
+WORDS_IT = ["oggi", "sono", "andato", "al", "lavoro", "e", "il", "capo", "mi", "ha", "detto", "che",
+            "la", "riunione", "è", "stata", "spostata", "ancora", "una", "volta", "domani", "treno"]
+WORDS_EN = ["today", "the", "meeting", "was", "moved", "again", "and", "my", "train", "is", "late"]
+IRONY_TRIGGERS = ["fantastico", "adoro", "traffico", "bloccato", "proprio il massimo", "che bello",
+                  "migliore", "dopo", "...", "!?"]
+
+
+### 🧪 Generatori di input sintetici ###
+
+def make_wav(path, seconds, channels=2, sample_width=2, frame_rate=16000, silence_ratio=0.3, seed=0):
+    """
+    Scrive un WAV sintetico: tratti di 'parlato' (toni modulati con rumore)
+    alternati a pause di silenzio, per una frazione silence_ratio della durata.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * frame_rate)
+    t = np.arange(n) / frame_rate
+    signal = np.sin(2 * np.pi * 220 * t) * (0.5 + 0.5 * np.sin(2 * np.pi * 3 * t))
+    signal += rng.normal(0, 0.05, n)
+
+    # Pause di silenzio a blocchi di mezzo secondo
+    block = frame_rate // 2
+    n_blocks = -(-n // block)
+    silent_blocks = rng.random(n_blocks) < silence_ratio
+    signal *= ~np.repeat(silent_blocks, block)[:n]
+    signal = np.clip(signal * 0.6, -1, 1)
+
+    if sample_width == 1:
+        samples = (signal * 127 + 128).astype(np.uint8)
+    elif sample_width == 2:
+        samples = (signal * 32767).astype(np.int16)
+    elif sample_width == 3:
+        # 24 bit: i tre byte meno significativi di ogni campione little-endian a 32 bit
+        samples = (signal * 8388607).astype("<i4").view(np.uint8).reshape(-1, 4)[:, :3]
+    elif sample_width == 4:
+        samples = (signal * 2147483647).astype(np.int32)
+    else:
+        raise ValueError("sample_width deve essere 1, 2, 3 o 4")
+
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(sample_width)
+        wav.setframerate(frame_rate)
+        wav.writeframes(np.repeat(samples, channels, axis=0).tobytes())
+    return path
+
+
+def make_jpeg(path, width, height, quality=90, seed=0):
+    """Scrive un JPEG sintetico (gradiente con rumore) delle dimensioni indicate"""
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    pixels = np.clip(gradient + rng.normal(0, 30, (height, width, 3)), 0, 255).astype(np.uint8)
+    Image.fromarray(pixels).save(path, "JPEG", quality=quality)
+    return path
+
+
+def make_corpus(n_texts, words_per_text=30, irony_rate=0.3, seed=0):
+    """Testi sintetici in italiano/inglese, una parte con indizi di ironia"""
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array(WORDS_IT + WORDS_EN, dtype=object)
+    corpus = []
+    for _ in range(n_texts):
+        words = list(rng.choice(vocabulary, words_per_text))
+        if rng.random() < irony_rate:
+            for trigger in rng.choice(IRONY_TRIGGERS, 2, replace=False):
+                words.insert(int(rng.integers(0, len(words))), trigger)
+        text = " ".join(words)
+        corpus.append(". ".join(text[i:i + 80].strip() for i in range(0, len(text), 80)) + ".")
+    return corpus
+
+
+### ⏱ Misura ###
+
+def measure(name, fn, units=1.0, unit="op", repeats=20, warmup=2):
+    """
+    Esegue fn ripetutamente e restituisce percentili di latenza, throughput
+    (unità al secondo) e picco di memoria allocata da Python durante un'esecuzione.
+    """
+    for _ in range(warmup):
+        fn()
+
+    timings = np.empty(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings[i] = time.perf_counter() - start
+
+    # Memoria misurata a parte: tracemalloc rallenta l'esecuzione e falserebbe i tempi
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+    return {
+        "name": name,
+        "unit": unit,
+        "p50_ms": p50 * 1000,
+        "p95_ms": p95 * 1000,
+        "p99_ms": p99 * 1000,
+        "mean_ms": timings.mean() * 1000,
+        "throughput": units / np.median(timings),
+        "peak_mb": peak / 1024 / 1024
+    }
+
+
+### 🔥 Percorsi CPU ###
+
+def bench_downmix(seconds, frame_rate=16000):
+    rng = np.random.default_rng(0)
+    stereo = rng.integers(-32768, 32767, int(seconds * frame_rate) * 2, dtype=np.int16)
+    return measure(f"downmix_{seconds}s", lambda: main._downmix_to_mono(stereo, 2),
+                   units=seconds, unit="s audio")
+
+
+def bench_prepare_audio(workdir, seconds, sample_width=2):
+    path = make_wav(os.path.join(workdir, f"bench_{seconds}s_{8 * sample_width}bit.wav"), seconds,
+                    sample_width=sample_width)
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            prepared = main._prepare_audio(path)
+        main._cleanup_prepared_audio(prepared)
+
+    # Il nome del caso a 16 bit resta quello della baseline esistente
+    suffix = f"_{8 * sample_width}bit" if sample_width != 2 else ""
+    return measure(f"prepare_audio_{seconds}s{suffix}", run, units=seconds, unit="s audio", repeats=10)
+
+
+def bench_image_load(workdir, width, height):
+    path = make_jpeg(os.path.join(workdir, f"bench_{width}x{height}.jpg"), width, height)
+
+    # Stesso percorso di analyze_face_expression prima della chiamata a Vision
+    def run():
+        with open(path, "rb") as image_file:
+            content = image_file.read()
+        return vision.Image(content=content)
+
+    return measure(f"image_load_{width}x{height}", run, units=1, unit="img")
+
+
+def bench_irony_scan(corpus, sentence_level=False):
+    sentences = [
+        [{"text": chunk, "score": 0.0} for _, chunk in main._split_document(text, 100)]
+        for text in corpus
+    ] if sentence_level else [None] * len(corpus)
+
+    def run():
+        for text, text_sentences in zip(corpus, sentences):
+            main._detect_sarcasm(text, 0.5, 1.0, text_sentences)
+
+    suffix = "_sentences" if sentence_level else ""
+    return measure(f"irony_scan{suffix}_{len(corpus)}", run, units=len(corpus), unit="text")
+
+
+def bench_fusion(n):
+    from irony_fusion import IronyFusionScorer
+
+    rng = np.random.default_rng(0)
+    batch = {
+        "text_score": rng.uniform(-1, 1, n).astype(np.float32),
+        "text_magnitude": rng.uniform(0, 3, n).astype(np.float32),
+        "irony_cues": rng.integers(0, 4, n),
+        "face": rng.integers(0, 6, (n, 4)).astype(np.int8),
+        "face_present": rng.random(n) < 0.7,
+        "transcript_score": rng.uniform(-1, 1, n).astype(np.float32),
+        "transcript_present": rng.random(n) < 0.5
+    }
+    scorer = IronyFusionScorer.from_config()
+    return measure(f"irony_fusion_{n}", lambda: scorer.score(batch), units=n, unit="result", repeats=5)
+
+
+### 🌐 End-to-end con client finti ###
+
+def _fake_clients(latency):
+    """Client Google finti che rispondono dopo 'latency' secondi con risposte realistiche"""
+    def delayed(response_fn):
+        def call(*args, **kwargs):
+            time.sleep(latency)
+            return response_fn(*args, **kwargs)
+        return call
+
+    def annotate(request=None, **kwargs):
+        text = request["document"].content
+        return language_v1.AnnotateTextResponse(
+            document_sentiment={"score": 0.4, "magnitude": 1.1},
+            sentences=[
+                {"text": {"content": chunk, "begin_offset": offset}, "sentiment": {"score": 0.4, "magnitude": 0.5}}
+                for offset, chunk in main._split_document(text, 200)
+            ]
+        )
+
+    language = mock.Mock()
+    language.analyze_sentiment.side_effect = delayed(lambda **kwargs: language_v1.AnalyzeSentimentResponse(
+        document_sentiment={"score": 0.6, "magnitude": 1.4}))
+    language.annotate_text.side_effect = delayed(annotate)
+
+    image_annotator = mock.Mock()
+    image_annotator.face_detection.side_effect = delayed(lambda **kwargs: vision.AnnotateImageResponse(
+        face_annotations=[{"joy_likelihood": 2, "sorrow_likelihood": 4, "anger_likelihood": 1,
+                           "surprise_likelihood": 3, "detection_confidence": 0.93}]))
+
+    operation = mock.Mock()
+    operation.result.side_effect = delayed(lambda **kwargs: speech.LongRunningRecognizeResponse(
+        results=[{"alternatives": [{"transcript": "che bello restare bloccati nel traffico", "confidence": 0.91}]}]))
+    speech_client = mock.Mock()
+    speech_client.long_running_recognize.side_effect = delayed(lambda **kwargs: operation)
+
+    return language, image_annotator, speech_client
+
+
+def bench_end_to_end(workdir, latency, audio_seconds=30):
+    image_path = make_jpeg(os.path.join(workdir, "e2e.jpg"), 640, 360)
+    audio_path = make_wav(os.path.join(workdir, f"e2e_{audio_seconds}s.wav"), audio_seconds)
+    language, image_annotator, speech_client = _fake_clients(latency)
+    staging = gcs_staging.GCSStagingManager(client=LocalStorageClient(os.path.join(workdir, "gcs")))
+    # Senza storico: nessuna scrittura su history.db e nessun hash dei file nella latenza misurata
+    argv = ["main.py", "--text", make_corpus(1, 40, irony_rate=1)[0], "--image", image_path, "--audio", audio_path,
+            "--no-history"]
+
+    def run():
+        with mock.patch.object(main.language_v1, "LanguageServiceClient", return_value=language), \
+                mock.patch.object(main.vision, "ImageAnnotatorClient", return_value=image_annotator), \
+                mock.patch.object(main.speech, "SpeechClient", return_value=speech_client), \
+                mock.patch.dict(gcs_staging._managers, {gcs_staging.DEFAULT_BUCKET: staging}), \
+                mock.patch.object(sys, "argv", argv), \
+                contextlib.redirect_stdout(io.StringIO()):
+            main.main()
+
+    result = measure(f"end_to_end_latency_{int(latency * 1000)}ms", run, units=1, unit="run", repeats=10, warmup=1)
+    staging.shutdown()
+    return result
+
+
+### 📊 Report e baseline ###
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Restituisce l'elenco dei casi peggiorati oltre la tolleranza"""
+    regressions = []
+    for result in results:
+        reference = baseline.get(result["name"])
+        if not reference:
+            continue
+        if result["p50_ms"] > reference["p50_ms"] * (1 + tolerance):
+            regressions.append(f"{result['name']}: p50 {result['p50_ms']:.2f} ms "
+                               f"(baseline {reference['p50_ms']:.2f} ms)")
+        elif result["throughput"] < reference["throughput"] / (1 + tolerance):
+            regressions.append(f"{result['name']}: throughput {result['throughput']:.1f} {result['unit']}/s "
+                               f"(baseline {reference['throughput']:.1f})")
+    return regressions
+
+
+def print_report(results, baseline):
+    print(f"{'Benchmark':<34} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'throughput':>20} {'peak MB':>8} {'vs base':>8}")
+    for result in results:
+        reference = baseline.get(result["name"])
+        delta = f"{result['p50_ms'] / reference['p50_ms'] - 1:+.0%}" if reference else "-"
+        throughput = f"{result['throughput']:,.1f} {result['unit']}/s"
+        print(f"{result['name']:<34} {result['p50_ms']:9.2f} {result['p95_ms']:9.2f} {result['p99_ms']:9.2f} "
+              f"{throughput:>20} {result['peak_mb']:8.2f} {delta:>8}")
+
+
+def run_benchmarks(quick=False, latencies=(0.0, 0.05)):
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    try:
+        scale = 1 if quick else 4
+        corpus = make_corpus(250 * scale)
+        results = [
+            bench_downmix(60 * scale),
+            bench_prepare_audio(workdir, 30 * scale),
+            bench_prepare_audio(workdir, 30 * scale, sample_width=3),
+            bench_image_load(workdir, 640, 480),
+            bench_image_load(workdir, 1920, 1080),
+            bench_irony_scan(corpus),
+            bench_irony_scan(corpus, sentence_level=True),
+            bench_fusion(250000 * scale),
+        ]
+        results += [bench_end_to_end(workdir, latency, audio_seconds=10 * scale) for latency in latencies]
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Benchmark dei percorsi critici dell'analizzatore")
+    parser.add_argument("--quick", action="store_true", help="Input più piccoli, per controlli rapidi")
+    parser.add_argument("--latency", default="0,0.05",
+                        help="Latenze (secondi) simulate per i client Google nei test end-to-end, separate da virgola")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="File JSON della baseline")
+    parser.add_argument("--save-baseline", action="store_true", help="Salva i risultati come nuova baseline")
+    parser.add_argument("--check", action="store_true",
+                        help="Fallisce anche se la baseline manca o non copre tutti i benchmark (per la CI)")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"Peggioramento massimo tollerato (default: {DEFAULT_TOLERANCE:.0%})")
+    args = parser.parse_args()
+
+    latencies = [float(latency) for latency in args.latency.split(",") if latency]
+    results = run_benchmarks(args.quick, latencies)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print_report(results, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({result["name"]: result for result in results}, f, indent=2)
+        print(f"\n✅ Baseline salvata in {args.baseline}")
+        return 0
+
+    if not baseline:
+        print("\n⚠️ Nessuna baseline trovata: esegui con --save-baseline per crearne una")
+        return 1 if args.check else 0
+
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    missing = [result["name"] for result in results if result["name"] not in baseline]
+    if missing and args.check:
+        regressions += [f"{name}: assente dalla baseline" for name in missing]
+    if regressions:
+        print("\n❌ Regressioni di prestazioni:")
+        for regression in regressions:
+            print(f"   {regression}")
+        return 1
+    print("\n✅ Nessuna regressione rispetto alla baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_benchmark())
@@ -0,0 +1,196 @@
+import os
+import csv
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Prefiltro locale (solo CPU) che stima se un'immagine contiene un volto prima
+# di chiamare Google Vision. Usa i classificatori Haar di OpenCV, dipendenza
+# opzionale (requirements-prefilter.txt): se opencv non è installato il
+# prefiltro non è disponibile e l'analisi procede sempre con Vision.
+
+# Classificatori usati: volto frontale e di profilo
+DEFAULT_CASCADES = ("haarcascade_frontalface_default.xml", "haarcascade_profileface.xml")
+
+# Soglia sul peso della detection più forte: più è bassa, meno volti vengono scartati
+DEFAULT_THRESHOLD = 0.0
+
+# Lato massimo dell'immagine analizzata localmente (le immagini più grandi vengono ridotte)
+MAX_SIDE = 640
+
+# Punteggio assegnato alle immagini senza alcuna detection
+NO_FACE_SCORE = float("-inf")
+
+
+def _load_cascades(cascade_names):
+    import cv2
+
+    cascades = []
+    for name in cascade_names:
+        path = name if os.path.isabs(name) else os.path.join(cv2.data.haarcascades, name)
+        cascade = cv2.CascadeClassifier(path)
+        if cascade.empty():
+            raise ValueError(f"Classificatore Haar non valido: {path}")
+        cascades.append(cascade)
+    return cascades
+
+
+def _face_score(cascades, image_path, max_side=MAX_SIDE, min_neighbors=1, scale_factor=1.1):
+    """
+    Restituisce il peso della detection più forte nell'immagine, NO_FACE_SCORE se
+    non c'è nessuna detection, o None se l'immagine non è leggibile.
+    """
+    import cv2
+
+    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None
+
+    # Riduce le immagini grandi: la detection resta affidabile ed è molto più veloce
+    scale = max_side / max(image.shape)
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    image = cv2.equalizeHist(image)
+
+    min_side = max(20, min(image.shape) // 20)
+    best = NO_FACE_SCORE
+    for cascade in cascades:
+        _, _, weights = cascade.detectMultiScale3(
+            image,
+            scaleFactor=scale_factor,
+            minNeighbors=min_neighbors,
+            minSize=(min_side, min_side),
+            outputRejectLevels=True
+        )
+        if len(weights):
+            best = max(best, float(np.max(weights)))
+    return best
+
+
+# Classificatori caricati una sola volta per ogni processo del pool
+_worker_cascades = {}
+
+
+def _score_in_worker(args):
+    image_path, cascade_names, max_side = args
+    if cascade_names not in _worker_cascades:
+        _worker_cascades[cascade_names] = _load_cascades(cascade_names)
+    return _face_score(_worker_cascades[cascade_names], image_path, max_side)
+
+
+class FacePrefilter:
+    """
+    Stima localmente la presenza di un volto. has_face() restituisce False solo
+    quando nessuna detection supera la soglia: nel dubbio (immagine illeggibile,
+    detection debole ma sopra soglia) l'immagine viene comunque inviata a Vision.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, cascades=DEFAULT_CASCADES, max_side=MAX_SIDE):
+        self.threshold = threshold
+        self.cascade_names = tuple(cascades)
+        self.max_side = max_side
+        self._cascades = _load_cascades(self.cascade_names)
+        self._lock = threading.Lock()
+        self.images_checked = 0
+        self.calls_avoided = 0
+
+    def score(self, image_path):
+        """Peso della detection più forte (NO_FACE_SCORE se assente, None se illeggibile)"""
+        return _face_score(self._cascades, image_path, self.max_side)
+
+    def score_batch(self, image_paths, max_workers=None):
+        """Calcola i punteggi di più immagini in parallelo in un pool di processi"""
+        args = [(path, self.cascade_names, self.max_side) for path in image_paths]
+        if len(args) <= 1:
+            return [_score_in_worker(arg) for arg in args]
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(_score_in_worker, args, chunksize=8))
+
+    def _passes(self, score):
+        return score is None or score >= self.threshold
+
+    def _record(self, passed):
+        with self._lock:
+            self.images_checked += len(passed)
+            self.calls_avoided += sum(1 for p in passed if not p)
+
+    def has_face(self, image_path):
+        """True se l'immagine va inviata a Vision"""
+        passed = self._passes(self.score(image_path))
+        self._record([passed])
+        return passed
+
+    def filter_batch(self, image_paths, max_workers=None):
+        """Restituisce per ogni immagine True se va inviata a Vision"""
+        passed = [self._passes(score) for score in self.score_batch(image_paths, max_workers)]
+        self._record(passed)
+        return passed
+
+    def stats(self):
+        """Chiamate a Vision evitate finora"""
+        with self._lock:
+            checked, avoided = self.images_checked, self.calls_avoided
+        return {
+            "images_checked": checked,
+            "calls_avoided": avoided,
+            "avoided_rate": avoided / checked if checked else 0.0
+        }
+
+    def evaluate(self, labeled_images, thresholds=None, max_workers=None):
+        """
+        Misura il prefiltro su un campione etichettato [(percorso, ha_volto), ...].
+        Per ogni soglia restituisce la quota di chiamate evitate e il tasso di falsi
+        negativi (volti veri che sarebbero stati scartati).
+        """
+        paths = [path for path, _ in labeled_images]
+        labels = np.array([bool(label) for _, label in labeled_images])
+        scores = np.array([
+            np.inf if score is None else score
+            for score in self.score_batch(paths, max_workers)
+        ])
+
+        report = []
+        for threshold in thresholds if thresholds is not None else [self.threshold]:
+            skipped = scores < threshold
+            faces = labels.sum()
+            report.append({
+                "threshold": threshold,
+                "avoided_rate": float(skipped.mean()) if len(skipped) else 0.0,
+                "false_negative_rate": float((skipped & labels).sum() / faces) if faces else 0.0,
+                "false_negatives": int((skipped & labels).sum())
+            })
+        return report
+
+
+def load_labeled_sample(csv_path):
+    """Legge un CSV con colonne 'path' e 'face' (1/0) relative alla posizione del file"""
+    base_dir = os.path.dirname(os.path.abspath(csv_path))
+    with open(csv_path, newline="") as f:
+        return [
+            (os.path.join(base_dir, row["path"]), row["face"].strip().lower() in ("1", "true", "yes", "si", "sì"))
+            for row in csv.DictReader(f)
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Valuta il prefiltro locale dei volti su un campione etichettato")
+    parser.add_argument("labels", help="CSV con colonne 'path' e 'face' (1 se l'immagine contiene un volto)")
+    parser.add_argument("--thresholds", default="-1,0,1,2,3", help="Soglie da confrontare, separate da virgola")
+    parser.add_argument("--workers", type=int, default=None, help="Numero di processi")
+    args = parser.parse_args()
+
+    sample = load_labeled_sample(args.labels)
+    thresholds = [float(t) for t in args.thresholds.split(",")]
+    report = FacePrefilter().evaluate(sample, thresholds, args.workers)
+
+    print(f"📊 Campione: {len(sample)} immagini, {sum(label for _, label in sample)} con volto")
+    print("Soglia | Chiamate evitate | Falsi negativi")
+    for row in report:
+        print(f"{row['threshold']:6.2f} | {row['avoided_rate']:15.1%} | "
+              f"{row['false_negative_rate']:.1%} ({row['false_negatives']})")
+
+
+if __name__ == "__main__":
+    main()
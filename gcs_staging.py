@@ -0,0 +1,249 @@
+import os
+import math
+import time
+import uuid
+import hashlib
+import threading
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# Bucket usato per i file temporanei da analizzare
+DEFAULT_BUCKET = "audio_analysis_temp"
+
+# Oltre questa dimensione il file viene caricato a blocchi paralleli
+PARALLEL_UPLOAD_THRESHOLD = 32 * 1024 * 1024
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Limite di GCS sul numero di oggetti sorgente in una singola compose
+MAX_COMPOSE_SOURCES = 32
+
+# Un blob che una regola di lifecycle eliminerà entro questo margine (in secondi)
+# non viene riutilizzato ma ricaricato: l'analisi potrebbe leggerlo dopo l'eliminazione
+REUSE_MARGIN = 6 * 60 * 60
+
+StagedBlob = namedtuple("StagedBlob", ["blob_name", "uri", "reused"])
+
+
+def file_digest(path, block_size=1024 * 1024):
+    """Calcola lo SHA-256 del contenuto di un file leggendolo a blocchi"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class GCSStagingManager:
+    """
+    Gestisce il caricamento temporaneo dei file su Google Cloud Storage.
+
+    Il bucket viene risolto una sola volta, i blob hanno nomi derivati dal
+    contenuto (due file identici condividono lo stesso oggetto) e l'eliminazione
+    avviene in background oppure tramite le regole di lifecycle del bucket.
+    Il client è iniettabile, per cui si può usare local_storage.LocalStorageClient
+    o un emulatore GCS al posto del servizio reale.
+    """
+
+    def __init__(self, bucket_name=DEFAULT_BUCKET, client=None, prefix="audio",
+                 parallel_threshold=PARALLEL_UPLOAD_THRESHOLD, chunk_size=CHUNK_SIZE,
+                 max_workers=4, cleanup="async", lifecycle_days=1):
+        if cleanup not in ("async", "lifecycle"):
+            raise ValueError("cleanup deve essere 'async' o 'lifecycle'")
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.parallel_threshold = parallel_threshold
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.cleanup = cleanup
+        self.lifecycle_days = lifecycle_days
+        self._client = client
+        self._bucket = None
+        self._lock = threading.Lock()
+        self._refs = Counter()
+        # Eliminazioni in corso: stage() dello stesso blob attende che finiscano
+        self._deleting = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gcs-staging")
+
+    @property
+    def client(self):
+        if self._client is None:
+            from google.cloud import storage
+            self._client = storage.Client()
+        return self._client
+
+    @property
+    def bucket(self):
+        """Restituisce il bucket, risolvendolo (o creandolo) solo alla prima chiamata"""
+        if self._bucket is None:
+            with self._lock:
+                if self._bucket is None:
+                    try:
+                        bucket = self.client.get_bucket(self.bucket_name)
+                    except Exception:
+                        print(f"⚠️ Bucket {self.bucket_name} non trovato, creazione in corso...")
+                        bucket = self.client.create_bucket(self.bucket_name)
+                    if self.cleanup == "lifecycle":
+                        self._ensure_lifecycle_rule(bucket)
+                    self._bucket = bucket
+        return self._bucket
+
+    def _ensure_lifecycle_rule(self, bucket):
+        """
+        Aggiunge al bucket una regola che elimina dopo lifecycle_days giorni gli oggetti
+        sotto il prefisso del manager (e solo quelli: il bucket è condiviso)
+        """
+        prefix = f"{self.prefix}/"
+        for rule in bucket.lifecycle_rules:
+            condition = rule.get("condition", {})
+            if rule.get("action", {}).get("type") == "Delete" and \
+                    condition.get("age") == self.lifecycle_days and \
+                    list(condition.get("matchesPrefix", [])) == [prefix]:
+                return
+        bucket.add_lifecycle_delete_rule(age=self.lifecycle_days, matches_prefix=[prefix])
+        bucket.patch()
+        print(f"✅ Regola di lifecycle impostata: eliminazione di {prefix} dopo {self.lifecycle_days} giorni")
+
+    def blob_name_for(self, path, digest=None):
+        """Nome del blob basato sull'hash del contenuto, senza collisioni tra file diversi"""
+        digest = digest or file_digest(path)
+        extension = os.path.splitext(path)[1].lower()
+        return f"{self.prefix}/{digest}{extension}"
+
+    def uri_for(self, blob_name):
+        return f"gs://{self.bucket_name}/{blob_name}"
+
+    def _expiry_age(self, blob_name):
+        """Età in secondi oltre la quale una regola di lifecycle del bucket elimina il blob, o None"""
+        ages = []
+        for rule in self.bucket.lifecycle_rules:
+            condition = rule.get("condition", {})
+            if rule.get("action", {}).get("type") != "Delete" or condition.get("age") is None:
+                continue
+            prefixes = condition.get("matchesPrefix")
+            if prefixes is None or any(blob_name.startswith(prefix) for prefix in prefixes):
+                ages.append(condition["age"] * 24 * 60 * 60)
+        return min(ages) if ages else None
+
+    def _reusable(self, blob):
+        """True se il blob esistente non rischia di essere eliminato dal lifecycle prima dell'analisi"""
+        expiry_age = self._expiry_age(blob.name)
+        if expiry_age is None or blob.time_created is None:
+            return True
+        age = time.time() - blob.time_created.timestamp()
+        return age < expiry_age - REUSE_MARGIN
+
+    def stage(self, path):
+        """Carica il file su GCS (se non è già presente) e restituisce uno StagedBlob"""
+        blob_name = self.blob_name_for(path)
+
+        while True:
+            with self._lock:
+                deleting = self._deleting.get(blob_name)
+                if deleting is None:
+                    self._refs[blob_name] += 1
+                    break
+            deleting.wait()
+
+        try:
+            # get_blob ricarica i metadati, tra cui la data di creazione
+            blob = self.bucket.get_blob(blob_name)
+            if blob is not None and self._reusable(blob):
+                print(f"♻️ File già presente su GCS, riutilizzo: {self.uri_for(blob_name)}")
+                return StagedBlob(blob_name, self.uri_for(blob_name), True)
+            if blob is not None:
+                print(f"🔄 File su GCS prossimo alla scadenza, nuovo caricamento: {self.uri_for(blob_name)}")
+            blob = self.bucket.blob(blob_name)
+
+            if os.path.getsize(path) >= self.parallel_threshold:
+                self._parallel_upload(path, blob)
+            else:
+                blob.upload_from_filename(path)
+        except Exception:
+            self._drop_ref(blob_name)
+            raise
+
+        return StagedBlob(blob_name, self.uri_for(blob_name), False)
+
+    def _parallel_upload(self, path, blob):
+        """Carica il file a blocchi in parallelo e li ricompone in un unico oggetto"""
+        size = os.path.getsize(path)
+        chunk_size = max(self.chunk_size, math.ceil(size / MAX_COMPOSE_SOURCES))
+        offsets = range(0, size, chunk_size)
+        print(f"🔄 Caricamento parallelo in {len(offsets)} blocchi...")
+
+        # Nomi dei blocchi unici per caricamento: due stage() concorrenti dello stesso
+        # file non devono scrivere (ed eliminare) gli stessi oggetti
+        upload_id = uuid.uuid4().hex
+
+        def upload_part(index, offset):
+            part = self.bucket.blob(f"{blob.name}.{upload_id}.part{index:02d}")
+            with open(path, "rb") as f:
+                f.seek(offset)
+                part.upload_from_string(f.read(chunk_size))
+            return part
+
+        futures = [self._executor.submit(upload_part, index, offset) for index, offset in enumerate(offsets)]
+        try:
+            parts = [future.result() for future in futures]
+            blob.compose(parts)
+        finally:
+            # Elimina anche i blocchi caricati se un altro blocco o la compose falliscono
+            for future in futures:
+                if not future.cancel() and future.exception() is None:
+                    self._executor.submit(self._delete_quietly, future.result())
+
+    def _drop_ref(self, blob_name):
+        with self._lock:
+            self._refs[blob_name] -= 1
+            if self._refs[blob_name] > 0:
+                return False
+            del self._refs[blob_name]
+            return True
+
+    def release(self, staged, delete=True):
+        """
+        Segnala che il file non serve più. Con cleanup='async' il blob viene eliminato
+        in background quando nessun'altra analisi in corso lo sta usando; con
+        cleanup='lifecycle' se ne occupa la regola del bucket. Con delete=False
+        viene solo rilasciato il riferimento (il blob è usato altrove).
+        """
+        if not self._drop_ref(staged.blob_name) or not delete or self.cleanup == "lifecycle":
+            return None
+        return self._executor.submit(self._delete_if_unused, staged.blob_name)
+
+    def _delete_if_unused(self, blob_name):
+        # La decisione è presa sotto il lock, l'eliminazione (una chiamata di rete) fuori:
+        # uno stage() concorrente dello stesso blob attende la fine e lo ricarica
+        with self._lock:
+            if self._refs[blob_name] or blob_name in self._deleting:
+                return
+            done = self._deleting[blob_name] = threading.Event()
+        try:
+            self._delete_quietly(self.bucket.blob(blob_name))
+        finally:
+            with self._lock:
+                del self._deleting[blob_name]
+            done.set()
+
+    @staticmethod
+    def _delete_quietly(blob):
+        try:
+            blob.delete()
+        except Exception as e:
+            print(f"⚠️ Impossibile eliminare {blob.name} da GCS: {e}")
+
+    def shutdown(self, wait=True):
+        """Attende le eliminazioni pendenti e chiude l'executor"""
+        self._executor.shutdown(wait=wait)
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_staging_manager(bucket_name=DEFAULT_BUCKET, **kwargs):
+    """Restituisce il GCSStagingManager condiviso per il bucket indicato"""
+    with _managers_lock:
+        if bucket_name not in _managers:
+            _managers[bucket_name] = GCSStagingManager(bucket_name, **kwargs)
+        return _managers[bucket_name]
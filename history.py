@@ -0,0 +1,231 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+
+from gcs_staging import file_digest
+from results import TextResult, FaceResult, AudioResult, Likelihood
+
+# Storico locale delle analisi. Ogni esecuzione viene salvata nella tabella runs
+# (con il risultato in formato binario compatto di results.py) e nello stesso
+# momento vengono aggiornati i totali giornalieri in daily_rollups, così che
+# medie, tassi di ironia e distribuzioni delle emozioni si leggano senza
+# riscandire lo storico né richiamare le API.
+
+DEFAULT_HISTORY_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.db")
+
+MODALITY_TEXT = "text"
+MODALITY_IMAGE = "image"
+MODALITY_AUDIO = "audio"
+
+RESULT_TYPES = {
+    MODALITY_TEXT: TextResult,
+    MODALITY_IMAGE: FaceResult,
+    MODALITY_AUDIO: AudioResult
+}
+
+EMOTIONS = FaceResult.EMOTIONS
+
+_ROLLUP_COLUMNS = ("runs", "errors", "scored", "score_sum", "magnitude_sum", "irony_count", "faces") + \
+    tuple(f"{emotion}_likely" for emotion in EMOTIONS)
+
+
+def input_digest(modality, value):
+    """Hash dell'input: del contenuto del testo, o del file per immagini e audio"""
+    if modality == MODALITY_TEXT:
+        return hashlib.sha256(value.encode("utf-8")).hexdigest()
+    return file_digest(value)
+
+
+def _day(timestamp):
+    return time.strftime("%Y-%m-%d", time.localtime(timestamp))
+
+
+class HistoryStore:
+    """Archivio SQLite delle analisi con totali giornalieri aggiornati a ogni inserimento"""
+
+    def __init__(self, db_path=DEFAULT_HISTORY_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id INTEGER PRIMARY KEY,
+                    input_hash TEXT NOT NULL,
+                    modality TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    started_at REAL NOT NULL,
+                    finished_at REAL NOT NULL,
+                    day TEXT NOT NULL,
+                    error INTEGER NOT NULL,
+                    score REAL,
+                    magnitude REAL,
+                    irony INTEGER,
+                    result BLOB NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_day ON runs (day, modality)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_input ON runs (input_hash, modality, finished_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_finished ON runs (finished_at)")
+            columns = ",\n".join(f"{column} {'REAL' if column.endswith('_sum') else 'INTEGER'} NOT NULL DEFAULT 0"
+                                 for column in _ROLLUP_COLUMNS)
+            self._conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS daily_rollups (
+                    day TEXT NOT NULL,
+                    modality TEXT NOT NULL,
+                    {columns},
+                    PRIMARY KEY (day, modality)
+                ) WITHOUT ROWID
+            """)
+
+    @staticmethod
+    def _row_values(modality, result, sentiment):
+        """Colonne di runs e incrementi dei totali per un risultato"""
+        compact = RESULT_TYPES[modality].from_dict(result)
+        error = "error" in result
+        if modality == MODALITY_TEXT:
+            sentiment = compact
+        elif sentiment is not None:
+            # Per l'audio lo score è quello del sentiment della trascrizione
+            sentiment = TextResult.from_dict(sentiment)
+
+        score = magnitude = irony = None
+        if sentiment is not None and not error:
+            score, magnitude, irony = sentiment.score, sentiment.magnitude, int(sentiment.sarcasm_detected)
+
+        increments = dict.fromkeys(_ROLLUP_COLUMNS, 0)
+        increments["runs"] = 1
+        increments["errors"] = int(error)
+        if score is not None:
+            increments.update(scored=1, score_sum=score, magnitude_sum=magnitude, irony_count=irony)
+        if modality == MODALITY_IMAGE and not error:
+            increments["faces"] = 1
+            for emotion in EMOTIONS:
+                increments[f"{emotion}_likely"] = int(getattr(compact, emotion) >= Likelihood.LIKELY)
+        return (int(error), score, magnitude, irony, compact.to_bytes()), increments
+
+    def record(self, modality, input_hash, result, source="cli", sentiment=None, started_at=None, finished_at=None):
+        """
+        Salva un'esecuzione e aggiorna i totali del giorno nella stessa transazione.
+        Per l'audio sentiment è il sentiment della trascrizione, se disponibile.
+        """
+        if modality not in RESULT_TYPES:
+            raise ValueError(f"Modalità sconosciuta: {modality}")
+        finished_at = finished_at or time.time()
+        started_at = started_at or finished_at
+        day = _day(finished_at)
+        values, increments = self._row_values(modality, result, sentiment)
+
+        updates = ", ".join(f"{column} = {column} + excluded.{column}" for column in _ROLLUP_COLUMNS)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO runs (input_hash, modality, source, started_at, finished_at, day, "
+                "error, score, magnitude, irony, result) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (input_hash, modality, source, started_at, finished_at, day, *values)
+            )
+            self._conn.execute(
+                f"INSERT INTO daily_rollups (day, modality, {', '.join(_ROLLUP_COLUMNS)}) "
+                f"VALUES (?, ?, {', '.join('?' * len(_ROLLUP_COLUMNS))}) "
+                f"ON CONFLICT (day, modality) DO UPDATE SET {updates}",
+                (day, modality, *(increments[column] for column in _ROLLUP_COLUMNS))
+            )
+        return cursor.lastrowid
+
+    def record_sentiment(self, run_id, sentiment):
+        """
+        Aggiunge a un'esecuzione audio già salvata il sentiment della trascrizione,
+        calcolato dopo la trascrizione (job in background), e aggiorna i totali del
+        suo giorno. Restituisce False se l'esecuzione non esiste, è un errore o ha già uno score.
+        """
+        if "error" in sentiment:
+            return False
+        compact = TextResult.from_dict(sentiment)
+        irony = int(compact.sarcasm_detected)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE runs SET score = ?, magnitude = ?, irony = ? "
+                "WHERE run_id = ? AND error = 0 AND score IS NULL",
+                (compact.score, compact.magnitude, irony, run_id)
+            )
+            if cursor.rowcount != 1:
+                return False
+            day, modality = self._conn.execute("SELECT day, modality FROM runs WHERE run_id = ?",
+                                               (run_id,)).fetchone()
+            self._conn.execute(
+                "UPDATE daily_rollups SET scored = scored + 1, score_sum = score_sum + ?, "
+                "magnitude_sum = magnitude_sum + ?, irony_count = irony_count + ? WHERE day = ? AND modality = ?",
+                (compact.score, compact.magnitude, irony, day, modality)
+            )
+        return True
+
+    @staticmethod
+    def _rollup_to_dict(row):
+        rollup = dict(row)
+        scored, faces = rollup["scored"], rollup["faces"]
+        rollup["avg_score"] = rollup["score_sum"] / scored if scored else None
+        rollup["avg_magnitude"] = rollup["magnitude_sum"] / scored if scored else None
+        rollup["irony_rate"] = rollup["irony_count"] / scored if scored else None
+        rollup["emotions"] = {emotion: rollup[f"{emotion}_likely"] / faces if faces else None
+                              for emotion in EMOTIONS}
+        return rollup
+
+    def daily(self, modality=None, start_day=None, end_day=None):
+        """Totali giornalieri con medie, tasso di ironia e quota di volti per emozione (LIKELY o più)"""
+        query = "SELECT * FROM daily_rollups WHERE 1 = 1"
+        params = []
+        if modality:
+            query += " AND modality = ?"
+            params.append(modality)
+        if start_day:
+            query += " AND day >= ?"
+            params.append(start_day)
+        if end_day:
+            query += " AND day <= ?"
+            params.append(end_day)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY day, modality", params).fetchall()
+        return [self._rollup_to_dict(row) for row in rows]
+
+    def summary(self, modality=None):
+        """Totali di tutto lo storico, calcolati dai totali giornalieri"""
+        sums = ", ".join(f"COALESCE(SUM({column}), 0) AS {column}" for column in _ROLLUP_COLUMNS)
+        query = f"SELECT {sums} FROM daily_rollups"
+        params = []
+        if modality:
+            query += " WHERE modality = ?"
+            params.append(modality)
+        with self._lock:
+            row = self._conn.execute(query, params).fetchone()
+        return self._rollup_to_dict(row)
+
+    def _run_to_dict(self, row):
+        run = dict(row)
+        run["result"] = RESULT_TYPES[run["modality"]].from_bytes(run["result"])
+        return run
+
+    def recent(self, limit=20, modality=None):
+        """Ultime esecuzioni, con il risultato come oggetto compatto di results.py"""
+        query = "SELECT * FROM runs"
+        params = []
+        if modality:
+            query += " WHERE modality = ?"
+            params.append(modality)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY finished_at DESC LIMIT ?", params + [limit]).fetchall()
+        return [self._run_to_dict(row) for row in rows]
+
+    def latest_for_input(self, input_hash, modality):
+        """Ultima esecuzione per lo stesso input, o None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM runs WHERE input_hash = ? AND modality = ? ORDER BY finished_at DESC LIMIT 1",
+                (input_hash, modality)
+            ).fetchone()
+        return self._run_to_dict(row) if row else None
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,183 @@
+import os
+import json
+
+import numpy as np
+
+from results import Likelihood
+
+# Fusione multimodale per la stima dell'ironia: combina sentiment del testo,
+# indizi testuali delle euristiche, emozioni del volto e sentiment della
+# trascrizione in un punteggio tra 0 e 1. Il punteggio è una probabilità solo
+# dopo calibrate() su un campione etichettato: i pesi di irony_weights.json sono
+# scelti a mano e non calibrati. Tutti i calcoli sono operazioni NumPy su interi
+# batch in formato colonnare (un array per campo), senza cicli per elemento.
+
+DEFAULT_WEIGHTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "irony_weights.json")
+
+EMOTIONS = ("joy", "sorrow", "anger", "surprise")
+
+# Stessa scala usata da Vision: 0 = UNKNOWN, 1 = VERY_UNLIKELY ... 5 = VERY_LIKELY
+LIKELIHOOD_VALUES = {likelihood.name: int(likelihood) for likelihood in Likelihood}
+
+FEATURES = (
+    "text_positive",            # parte positiva dello score del testo
+    "text_negative",            # parte negativa dello score del testo
+    "text_magnitude",           # log(1 + magnitude)
+    "irony_cues",               # indizi testuali delle euristiche (max 3)
+    "face_joy",
+    "face_negative",            # max(tristezza, rabbia)
+    "face_surprise",
+    "positive_text_sad_face",   # testo positivo con volto triste/arrabbiato
+    "negative_text_happy_face", # testo negativo con volto sorridente
+    "transcript_contrast",      # differenza di score tra testo e trascrizione
+)
+
+
+def _as_array(batch, key, n, dtype=np.float32, default=0):
+    value = batch.get(key)
+    if value is None:
+        return np.full(n, default, dtype=dtype)
+    return np.asarray(value, dtype=dtype)
+
+
+def columns_from_results(text_results, image_results=None, transcript_sentiments=None):
+    """
+    Converte liste di dizionari (come restituiti da main.py) nel formato colonnare
+    accettato da IronyFusionScorer. Le modalità mancanti o in errore vengono
+    marcate come assenti.
+    """
+    n = len(text_results)
+    image_results = image_results if image_results is not None else [None] * n
+    transcript_sentiments = transcript_sentiments if transcript_sentiments is not None else [None] * n
+
+    face = np.zeros((n, len(EMOTIONS)), dtype=np.int8)
+    face_present = np.zeros(n, dtype=bool)
+    for i, image in enumerate(image_results):
+        if image and "error" not in image:
+            face[i] = [LIKELIHOOD_VALUES.get(image.get(emotion), 0) for emotion in EMOTIONS]
+            face_present[i] = True
+
+    text_score = np.array([t["score"] for t in text_results], dtype=np.float32)
+    text_magnitude = np.array([t["magnitude"] for t in text_results], dtype=np.float32)
+    irony_hits = np.array([t.get("irony_hits", int(t["sarcasm_detected"])) for t in text_results], dtype=np.float32)
+    # irony_hits comprende la regola score > 0 e magnitude > 0.8 di main._detect_sarcasm,
+    # che text_positive e text_magnitude già rappresentano: restano solo gli indizi testuali
+    score_rule = (text_score > 0) & (text_magnitude > 0.8)
+    transcript_present = np.array([bool(t) for t in transcript_sentiments], dtype=bool)
+    return {
+        "text_score": text_score,
+        "text_magnitude": text_magnitude,
+        "irony_cues": np.maximum(irony_hits - score_rule, 0),
+        "face": face,
+        "face_present": face_present,
+        "transcript_score": np.array([t["score"] if t else 0 for t in transcript_sentiments], dtype=np.float32),
+        "transcript_present": transcript_present
+    }
+
+
+class IronyFusionScorer:
+    """
+    Regressione logistica sulle feature multimodali, con calibrazione di Platt.
+    calibrated indica se slope e intercept sono stati stimati con calibrate():
+    senza calibrazione score() restituisce un punteggio, non una probabilità.
+    """
+
+    def __init__(self, weights, bias=0.0, slope=1.0, intercept=0.0, calibrated=False):
+        self.weights = np.array([weights.get(name, 0.0) for name in FEATURES], dtype=np.float32)
+        self.bias = float(bias)
+        self.slope = float(slope)
+        self.intercept = float(intercept)
+        self.calibrated = bool(calibrated)
+
+    @classmethod
+    def from_config(cls, path=DEFAULT_WEIGHTS_PATH):
+        """Carica pesi e calibrazione da un file JSON"""
+        with open(path) as f:
+            config = json.load(f)
+        calibration = config.get("calibration") or {}
+        return cls(
+            config["weights"],
+            bias=config.get("bias", 0.0),
+            slope=calibration.get("slope", 1.0),
+            intercept=calibration.get("intercept", 0.0),
+            calibrated=bool(calibration)
+        )
+
+    def save(self, path):
+        """Salva pesi e calibrazione in un file JSON"""
+        config = {
+            "bias": self.bias,
+            "weights": {name: float(w) for name, w in zip(FEATURES, self.weights)},
+            "calibration": {"slope": self.slope, "intercept": self.intercept} if self.calibrated else None
+        }
+        with open(path, "w") as f:
+            json.dump(config, f, indent=2)
+
+    @staticmethod
+    def features(batch):
+        """Matrice (n, len(FEATURES)) delle feature di un batch colonnare"""
+        text_score = np.asarray(batch["text_score"], dtype=np.float32)
+        n = len(text_score)
+
+        face_present = _as_array(batch, "face_present", n, bool, False)
+        face = np.asarray(batch["face"], dtype=np.float32) if batch.get("face") is not None \
+            else np.zeros((n, len(EMOTIONS)), dtype=np.float32)
+        # Likelihood da 1..5 a 0..1 (UNKNOWN e volto assente valgono 0)
+        face = np.clip((face - 1) / 4, 0, 1) * face_present[:, None]
+        joy, sorrow, anger, surprise = face.T
+
+        transcript_present = _as_array(batch, "transcript_present", n, bool, False)
+        transcript_score = _as_array(batch, "transcript_score", n)
+
+        text_positive = np.clip(text_score, 0, 1)
+        text_negative = np.clip(-text_score, 0, 1)
+        face_negative = np.maximum(sorrow, anger)
+
+        X = np.empty((n, len(FEATURES)), dtype=np.float32)
+        X[:, 0] = text_positive
+        X[:, 1] = text_negative
+        X[:, 2] = np.log1p(_as_array(batch, "text_magnitude", n))
+        X[:, 3] = np.minimum(_as_array(batch, "irony_cues", n), 3)
+        X[:, 4] = joy
+        X[:, 5] = face_negative
+        X[:, 6] = surprise
+        X[:, 7] = text_positive * face_negative
+        X[:, 8] = text_negative * joy
+        X[:, 9] = np.abs(text_score - transcript_score) * transcript_present
+        return X
+
+    def logits(self, batch):
+        return self.features(batch) @ self.weights + self.bias
+
+    def score(self, batch, chunk_size=1000000):
+        """Punteggio di ironia per ogni elemento del batch (una probabilità se calibrated)"""
+        n = len(batch["text_score"])
+        probabilities = np.empty(n, dtype=np.float32)
+        # A blocchi, per limitare la memoria delle matrici intermedie su batch molto grandi
+        for start in range(0, n, chunk_size):
+            part = {key: (value[start:start + chunk_size] if value is not None else None)
+                    for key, value in batch.items()}
+            z = self.slope * self.logits(part) + self.intercept
+            probabilities[start:start + chunk_size] = 1 / (1 + np.exp(-z))
+        return probabilities
+
+    def calibrate(self, batch, labels, iterations=50):
+        """
+        Stima slope e intercept (scaling di Platt) su un campione etichettato
+        (labels: 1 se ironico) con il metodo di Newton.
+        """
+        z = self.logits(batch).astype(np.float64)
+        y = np.asarray(labels, dtype=np.float64)
+        Z = np.column_stack([z, np.ones_like(z)])
+        params = np.array([self.slope, self.intercept])
+        for _ in range(iterations):
+            p = 1 / (1 + np.exp(-(Z @ params)))
+            gradient = Z.T @ (p - y)
+            hessian = (Z * (p * (1 - p))[:, None]).T @ Z + 1e-6 * np.eye(2)
+            step = np.linalg.solve(hessian, gradient)
+            params -= step
+            if np.abs(step).max() < 1e-8:
+                break
+        self.slope, self.intercept = float(params[0]), float(params[1])
+        self.calibrated = True
+        return self
@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+# Database locale in cui vengono salvati i job in corso e i risultati
+DEFAULT_JOB_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.db")
+
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_ERROR = "error"
+
+
+class JobStore:
+    """
+    Archivio SQLite dei job a lunga durata. Per ogni job salva il nome
+    dell'operazione Google, i dati necessari a completarlo e il risultato,
+    così che i job sopravvivano al riavvio del processo.
+    """
+
+    def __init__(self, db_path=DEFAULT_JOB_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    operation_name TEXT,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    result TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, kind)")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_chunks (
+                    job_id TEXT NOT NULL,
+                    chunk_index INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    operation_name TEXT,
+                    output_prefix TEXT,
+                    error TEXT,
+                    items TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (job_id, chunk_index)
+                ) WITHOUT ROWID
+            """)
+
+    def create(self, kind, operation_name, payload, status=STATUS_RUNNING, result=None):
+        """Registra un nuovo job (di norma in corso) e ne restituisce l'id"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, operation_name, status, json.dumps(payload),
+                 json.dumps(result) if result is not None else None, now, now)
+            )
+        return job_id
+
+    def update(self, job_id, status, result=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, updated_at = ? WHERE job_id = ?",
+                (status, json.dumps(result) if result is not None else None, time.time(), job_id)
+            )
+
+    def finish(self, job_id, status, result=None):
+        """
+        Chiude un job ancora in corso. Restituisce False se un altro poller (anche in
+        un altro processo) l'ha già chiuso: solo chi lo chiude esegue le azioni successive.
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, updated_at = ? WHERE job_id = ? AND status = ?",
+                (status, json.dumps(result) if result is not None else None, time.time(), job_id, STATUS_RUNNING)
+            )
+        return cursor.rowcount == 1
+
+    def get(self, job_id):
+        """Restituisce il job come dizionario, o None se non esiste"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def running(self, kind=None):
+        """Elenca i job ancora in corso, eventualmente filtrati per tipo"""
+        query = "SELECT * FROM jobs WHERE status = ?"
+        params = [STATUS_RUNNING]
+        if kind:
+            query += " AND kind = ?"
+            params.append(kind)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY created_at", params).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def save_chunk(self, job_id, index, status, operation_name=None, output_prefix=None, error=None, items=None):
+        """
+        Salva lo stato di un blocco di un job diviso in più operazioni. items (ad esempio
+        gli URI degli input del blocco) viene scritto una sola volta e mantenuto se None.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO job_chunks VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (job_id, chunk_index) DO UPDATE SET status = excluded.status, "
+                "operation_name = excluded.operation_name, output_prefix = excluded.output_prefix, "
+                "error = excluded.error, items = COALESCE(excluded.items, items), updated_at = excluded.updated_at",
+                (job_id, index, status, operation_name, output_prefix, error,
+                 json.dumps(items) if items is not None else None, time.time())
+            )
+
+    def chunks(self, job_id, status=None):
+        """Blocchi del job in ordine di indice (senza items), eventualmente filtrati per stato"""
+        query = ("SELECT job_id, chunk_index, status, operation_name, output_prefix, error, updated_at "
+                 "FROM job_chunks WHERE job_id = ?")
+        params = [job_id]
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY chunk_index", params).fetchall()
+        return [dict(row) for row in rows]
+
+    def chunk_items(self, job_id, index):
+        """Elementi salvati con il blocco, o None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT items FROM job_chunks WHERE job_id = ? AND chunk_index = ?", (job_id, index)
+            ).fetchone()
+        return json.loads(row["items"]) if row and row["items"] else None
+
+    @staticmethod
+    def _row_to_job(row):
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def close(self):
+        self._conn.close()
+
+
+def get_operation(client, operation_name):
+    """Recupera lo stato di un'operazione a lunga durata a partire dal suo nome"""
+    return client.get_operation({"name": operation_name})
@@ -0,0 +1,273 @@
+import re
+import json
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from main import analyze_text_sentiment, _detect_sarcasm
+
+# Cascata "local-first" per il sentiment: un modello a lessico italiano/inglese
+# calcola lo score in locale, senza rete, e solo i testi incerti (quasi neutri,
+# con poca copertura del lessico o con indizi di ironia) vengono inviati
+# all'API Google Natural Language.
+
+# Valenza delle parole, da -1 (molto negativo) a +1 (molto positivo)
+LEXICON = {
+    # Italiano
+    "adoro": 0.8, "amo": 0.8, "bello": 0.6, "bella": 0.6, "bellissimo": 0.9, "bellissima": 0.9,
+    "bene": 0.5, "benissimo": 0.8, "buono": 0.5, "buona": 0.5, "ottimo": 0.8, "ottima": 0.8,
+    "fantastico": 0.9, "fantastica": 0.9, "perfetto": 0.8, "perfetta": 0.8, "felice": 0.8,
+    "contento": 0.6, "contenta": 0.6, "grazie": 0.4, "migliore": 0.6, "meraviglioso": 0.9,
+    "meravigliosa": 0.9, "piacere": 0.5, "piace": 0.5, "splendido": 0.8, "divertente": 0.6,
+    "gentile": 0.5, "eccellente": 0.9, "fortuna": 0.5, "soddisfatto": 0.6, "soddisfatta": 0.6,
+    "brutto": -0.6, "brutta": -0.6, "male": -0.5, "malissimo": -0.8, "cattivo": -0.6,
+    "cattiva": -0.6, "terribile": -0.9, "orribile": -0.9, "pessimo": -0.9, "pessima": -0.9,
+    "odio": -0.9, "triste": -0.7, "arrabbiato": -0.7, "arrabbiata": -0.7, "schifo": -0.9,
+    "peggiore": -0.7, "noioso": -0.5, "noiosa": -0.5, "problema": -0.4, "problemi": -0.4,
+    "ritardo": -0.4, "bloccato": -0.5, "bloccata": -0.5, "traffico": -0.3, "delusione": -0.7,
+    "deluso": -0.7, "delusa": -0.7, "disastro": -0.9, "paura": -0.6, "stanco": -0.4,
+    "stanca": -0.4, "rotto": -0.5, "rotta": -0.5, "sbagliato": -0.5, "inutile": -0.6,
+    # Inglese
+    "love": 0.8, "like": 0.4, "good": 0.5, "great": 0.7, "excellent": 0.9, "amazing": 0.9,
+    "awesome": 0.8, "wonderful": 0.9, "fantastic": 0.9, "perfect": 0.8, "happy": 0.8,
+    "glad": 0.6, "nice": 0.5, "best": 0.7, "better": 0.4, "beautiful": 0.8, "thanks": 0.4,
+    "fun": 0.6, "enjoy": 0.6, "brilliant": 0.8, "pleased": 0.6,
+    "bad": -0.6, "worse": -0.6, "worst": -0.9, "terrible": -0.9, "awful": -0.9,
+    "horrible": -0.9, "hate": -0.9, "sad": -0.7, "angry": -0.7, "boring": -0.5,
+    "problem": -0.4, "late": -0.3, "stuck": -0.5, "broken": -0.5, "disaster": -0.9,
+    "disappointed": -0.7, "annoying": -0.6, "useless": -0.6, "wrong": -0.5, "tired": -0.4,
+    "traffic": -0.3, "fail": -0.6, "failed": -0.6,
+}
+
+# Parole che invertono la polarità delle tre parole successive
+NEGATORS = {"non", "mai", "nessuno", "nessuna", "niente", "nulla", "né", "not", "never", "no", "nobody",
+            "nothing", "dont", "doesnt", "didnt", "isnt", "wasnt", "cant", "wont"}
+
+# Parole che amplificano la parola successiva
+INTENSIFIERS = {"molto": 1.5, "davvero": 1.4, "proprio": 1.3, "troppo": 1.4, "tanto": 1.3,
+                "super": 1.5, "very": 1.5, "really": 1.4, "so": 1.3, "too": 1.3,
+                "extremely": 1.7, "totally": 1.4}
+
+NEGATION_SCOPE = 3
+NEGATION_FACTOR = -0.8
+
+# Costante di normalizzazione dello score in [-1, 1] (come in VADER)
+NORMALIZATION_ALPHA = 1.5
+
+TOKEN_PATTERN = re.compile(r"[a-zàèéìíòóùú]+")
+
+# Soglie predefinite della cascata
+DEFAULT_NEUTRAL_BAND = 0.25
+DEFAULT_MIN_CONFIDENCE = 0.5
+
+
+class LexiconSentimentModel:
+    """
+    Modello di sentiment a lessico. La tokenizzazione è per testo, ma il calcolo
+    degli score avviene su tutti i token del batch con operazioni NumPy.
+    """
+
+    def __init__(self, lexicon=None, negators=None, intensifiers=None):
+        lexicon = LEXICON if lexicon is None else lexicon
+        negators = NEGATORS if negators is None else negators
+        intensifiers = INTENSIFIERS if intensifiers is None else intensifiers
+
+        words = sorted(set(lexicon) | set(negators) | set(intensifiers))
+        self.vocabulary = {word: i for i, word in enumerate(words)}
+        # Ultimo indice riservato alle parole sconosciute
+        size = len(words) + 1
+        self.valence = np.zeros(size, dtype=np.float32)
+        self.is_negator = np.zeros(size, dtype=bool)
+        self.multiplier = np.ones(size, dtype=np.float32)
+        for word, i in self.vocabulary.items():
+            self.valence[i] = lexicon.get(word, 0.0)
+            self.is_negator[i] = word in negators
+            self.multiplier[i] = intensifiers.get(word, 1.0)
+        self._unknown = size - 1
+
+    def _token_ids(self, texts):
+        unknown = self._unknown
+        vocabulary = self.vocabulary
+        ids = []
+        lengths = np.empty(len(texts), dtype=np.int64)
+        for i, text in enumerate(texts):
+            tokens = TOKEN_PATTERN.findall(text.lower().replace("'", ""))
+            ids.extend(vocabulary.get(token, unknown) for token in tokens)
+            lengths[i] = len(tokens)
+        return np.array(ids, dtype=np.int64), lengths
+
+    def score_batch(self, texts):
+        """
+        Restituisce array con score in [-1, 1], magnitude (somma delle valenze in
+        valore assoluto), numero di parole del lessico trovate e confidenza in [0, 1].
+        """
+        n = len(texts)
+        ids, lengths = self._token_ids(texts)
+        doc = np.repeat(np.arange(n), lengths)
+
+        valence = self.valence[ids]
+        negator = self.is_negator[ids]
+        multiplier = self.multiplier[ids]
+
+        # Negazione: una delle NEGATION_SCOPE parole precedenti (nello stesso testo) è un negatore
+        negated = np.zeros(len(ids), dtype=bool)
+        for shift in range(1, NEGATION_SCOPE + 1):
+            previous = np.zeros(len(ids), dtype=bool)
+            previous[shift:] = negator[:-shift] & (doc[shift:] == doc[:-shift])
+            negated |= previous
+
+        # Intensificatore immediatamente precedente
+        boost = np.ones(len(ids), dtype=np.float32)
+        boost[1:] = np.where(doc[1:] == doc[:-1], multiplier[:-1], 1.0)
+
+        contribution = valence * boost * np.where(negated, NEGATION_FACTOR, 1.0)
+        total = np.bincount(doc, weights=contribution, minlength=n)
+        magnitude = np.bincount(doc, weights=np.abs(contribution), minlength=n)
+        hits = np.bincount(doc, weights=(valence != 0), minlength=n)
+
+        score = total / np.sqrt(total * total + NORMALIZATION_ALPHA)
+        # Confidenza: cresce con le parole trovate e cala se le polarità sono in conflitto
+        agreement = np.divide(np.abs(total), magnitude, out=np.zeros(n), where=magnitude > 0)
+        confidence = (1 - np.exp(-hits / 2)) * agreement
+
+        return {
+            "score": score.astype(np.float32),
+            "magnitude": magnitude.astype(np.float32),
+            "hits": hits.astype(np.int32),
+            "confidence": confidence.astype(np.float32)
+        }
+
+
+def _polarity(score, neutral_band):
+    return 0 if abs(score) < neutral_band else (1 if score > 0 else -1)
+
+
+class SentimentCascade:
+    """
+    Analisi del sentiment "local-first": il modello locale risponde per i casi
+    evidenti e l'API viene chiamata solo per i testi quasi neutri, poco coperti
+    dal lessico o con indizi di ironia. Con audit_rate > 0 una quota casuale dei
+    casi evidenti viene comunque inviata all'API per misurare l'accordo tra i due.
+    """
+
+    def __init__(self, model=None, neutral_band=DEFAULT_NEUTRAL_BAND, min_confidence=DEFAULT_MIN_CONFIDENCE,
+                 audit_rate=0.0, api_fn=analyze_text_sentiment, max_workers=4, seed=None):
+        self.model = model or LexiconSentimentModel()
+        self.neutral_band = neutral_band
+        self.min_confidence = min_confidence
+        self.audit_rate = audit_rate
+        self.api_fn = api_fn
+        self.max_workers = max_workers
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self.texts = 0
+        self.escalated = 0
+        self.api_errors = 0
+        self.compared = 0
+        self.agreed = 0
+
+    def escalation_mask(self, texts, local):
+        """True per i testi da inviare all'API"""
+        # Solo gli indizi testuali: il metodo basato su score e magnitude vale per la scala dell'API
+        irony = np.array([_detect_sarcasm(text, 0, 0) > 0 for text in texts], dtype=bool)
+        uncertain = (np.abs(local["score"]) < self.neutral_band) | (local["confidence"] < self.min_confidence)
+        audit = self._rng.random(len(texts)) < self.audit_rate
+        return uncertain | irony | audit
+
+    def analyze_batch(self, texts):
+        """Analizza un batch di testi; ogni risultato indica in 'source' se viene dal modello locale o dall'API"""
+        local = self.model.score_batch(texts)
+        escalate = self.escalation_mask(texts, local)
+        to_api = np.flatnonzero(escalate)
+
+        results = [None] * len(texts)
+        for i in np.flatnonzero(~escalate):
+            # I testi con indizi testuali di ironia sono già stati inviati all'API
+            results[i] = {
+                "score": float(local["score"][i]),
+                "magnitude": float(local["magnitude"][i]),
+                "sarcasm_detected": False,
+                "irony_hits": 0,
+                "source": "local"
+            }
+
+        if len(to_api):
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(to_api))) as executor:
+                api_results = list(executor.map(self.api_fn, [texts[i] for i in to_api]))
+        else:
+            api_results = []
+
+        compared = agreed = errors = 0
+        for i, result in zip(to_api, api_results):
+            results[i] = {**result, "source": "api"}
+            # Le chiamate fallite non dicono nulla sull'accordo tra i due modelli
+            if "error" in result:
+                errors += 1
+                continue
+            compared += 1
+            agreed += _polarity(result["score"], self.neutral_band) == _polarity(local["score"][i], self.neutral_band)
+
+        with self._lock:
+            self.texts += len(texts)
+            self.escalated += len(to_api)
+            self.api_errors += errors
+            self.compared += compared
+            self.agreed += agreed
+        return results
+
+    def analyze(self, text):
+        return self.analyze_batch([text])[0]
+
+    def stats(self):
+        """Quota di testi inviati all'API e accordo di polarità tra modello locale e API"""
+        with self._lock:
+            return {
+                "texts": self.texts,
+                "escalated": self.escalated,
+                "escalation_rate": self.escalated / self.texts if self.texts else 0.0,
+                "api_errors": self.api_errors,
+                "compared": self.compared,
+                "agreement_rate": self.agreed / self.compared if self.compared else None
+            }
+
+
+def format_stats(stats):
+    """Riepilogo leggibile delle statistiche della cascata"""
+    line = (f"🧭 Cascata locale: {stats['escalated']} testi su {stats['texts']} inviati all'API "
+            f"({stats['escalation_rate']:.0%})")
+    if stats["agreement_rate"] is not None:
+        line += f", accordo locale/API {stats['agreement_rate']:.0%} su {stats['compared']} confronti"
+    if stats["api_errors"]:
+        line += f", {stats['api_errors']} chiamate fallite"
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sentiment local-first su un file di testi (uno per riga)")
+    parser.add_argument("texts", help="File di testo con un testo per riga")
+    parser.add_argument("--neutral-band", type=float, default=DEFAULT_NEUTRAL_BAND,
+                        help=f"Score locali sotto questa soglia vanno all'API (default: {DEFAULT_NEUTRAL_BAND})")
+    parser.add_argument("--min-confidence", type=float, default=DEFAULT_MIN_CONFIDENCE,
+                        help=f"Confidenza locale minima (default: {DEFAULT_MIN_CONFIDENCE})")
+    parser.add_argument("--audit-rate", type=float, default=0.0,
+                        help="Quota dei testi evidenti inviata comunque all'API per misurare l'accordo")
+    parser.add_argument("--output", help="File JSON Lines in cui scrivere i risultati")
+    args = parser.parse_args()
+
+    with open(args.texts, encoding="utf-8") as f:
+        texts = [line.strip() for line in f if line.strip()]
+
+    cascade = SentimentCascade(neutral_band=args.neutral_band, min_confidence=args.min_confidence,
+                               audit_rate=args.audit_rate)
+    results = cascade.analyze_batch(texts)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            for text, result in zip(texts, results):
+                f.write(json.dumps({"text": text, **result}, ensure_ascii=False) + "\n")
+    print(format_stats(cascade.stats()))
+
+
+if __name__ == "__main__":
+    main()
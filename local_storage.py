@@ -0,0 +1,154 @@
+import os
+import shutil
+import datetime
+import uuid
+import threading
+
+# Sostituto locale di google.cloud.storage basato sul filesystem.
+# Implementa solo il sottoinsieme di API usato dal progetto (bucket, blob,
+# upload/download, compose, list_blobs, regole di lifecycle) per poter
+# provare staging e job batch senza accesso a Google Cloud.
+
+# Suffisso dei file in scrittura, non ancora visibili come oggetti
+TEMP_SUFFIX = ".tmp-upload"
+
+
+class LocalNotFound(Exception):
+    """Equivalente locale di google.api_core.exceptions.NotFound"""
+
+
+class LocalBlob:
+    """Oggetto in un bucket locale, salvato come file nella directory del bucket"""
+
+    def __init__(self, name, bucket):
+        self.name = name
+        self.bucket = bucket
+
+    @property
+    def _path(self):
+        return os.path.join(self.bucket._root, *self.name.split("/"))
+
+    @property
+    def size(self):
+        return os.path.getsize(self._path) if self.exists() else None
+
+    @property
+    def time_created(self):
+        if not self.exists():
+            return None
+        return datetime.datetime.fromtimestamp(os.path.getmtime(self._path), datetime.timezone.utc)
+
+    def exists(self, client=None):
+        return os.path.isfile(self._path)
+
+    def _temp_path(self):
+        # Come su GCS, l'oggetto compare solo a scrittura completata
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        return f"{self._path}.{uuid.uuid4().hex}{TEMP_SUFFIX}"
+
+    def upload_from_filename(self, filename, **kwargs):
+        temp_path = self._temp_path()
+        shutil.copyfile(filename, temp_path)
+        os.replace(temp_path, self._path)
+
+    def upload_from_string(self, data, **kwargs):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        temp_path = self._temp_path()
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, self._path)
+
+    def download_as_bytes(self, **kwargs):
+        if not self.exists():
+            raise LocalNotFound(f"gs://{self.bucket.name}/{self.name}")
+        with open(self._path, "rb") as f:
+            return f.read()
+
+    def open(self, mode="rb"):
+        if "r" in mode and not self.exists():
+            raise LocalNotFound(f"gs://{self.bucket.name}/{self.name}")
+        if "w" in mode:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        return open(self._path, mode)
+
+    def compose(self, sources, **kwargs):
+        temp_path = self._temp_path()
+        with open(temp_path, "wb") as out:
+            for source in sources:
+                with open(source._path, "rb") as part:
+                    shutil.copyfileobj(part, out)
+        os.replace(temp_path, self._path)
+
+    def delete(self, **kwargs):
+        if not self.exists():
+            raise LocalNotFound(f"gs://{self.bucket.name}/{self.name}")
+        os.remove(self._path)
+
+
+class LocalBucket:
+    """Bucket locale: una directory sotto la radice del client"""
+
+    def __init__(self, name, root):
+        self.name = name
+        self._root = root
+        self.lifecycle_rules = []
+
+    def blob(self, blob_name):
+        return LocalBlob(blob_name, self)
+
+    def get_blob(self, blob_name):
+        blob = self.blob(blob_name)
+        return blob if blob.exists() else None
+
+    def list_blobs(self, prefix=None):
+        blobs = []
+        for dirpath, _, filenames in os.walk(self._root):
+            for filename in filenames:
+                if filename.endswith(TEMP_SUFFIX):
+                    continue
+                rel = os.path.relpath(os.path.join(dirpath, filename), self._root)
+                name = rel.replace(os.sep, "/")
+                if prefix is None or name.startswith(prefix):
+                    blobs.append(LocalBlob(name, self))
+        return sorted(blobs, key=lambda b: b.name)
+
+    def add_lifecycle_delete_rule(self, **kwargs):
+        # Condizioni con le chiavi camelCase dell'API, come in google.cloud.storage
+        condition = {"".join(word.capitalize() if i else word for i, word in enumerate(key.split("_"))): value
+                     for key, value in kwargs.items()}
+        self.lifecycle_rules.append({"action": {"type": "Delete"}, "condition": condition})
+
+    def patch(self, **kwargs):
+        pass
+
+
+class LocalStorageClient:
+    """Client compatibile con storage.Client che salva i bucket sotto una directory locale"""
+
+    def __init__(self, root):
+        self.root = root
+        self._buckets = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def get_bucket(self, bucket_name):
+        with self._lock:
+            path = os.path.join(self.root, bucket_name)
+            if not os.path.isdir(path):
+                raise LocalNotFound(f"Bucket {bucket_name} non trovato")
+            return self._buckets.setdefault(bucket_name, LocalBucket(bucket_name, path))
+
+    def create_bucket(self, bucket_name, **kwargs):
+        with self._lock:
+            path = os.path.join(self.root, bucket_name)
+            os.makedirs(path, exist_ok=True)
+            return self._buckets.setdefault(bucket_name, LocalBucket(bucket_name, path))
+
+    def bucket(self, bucket_name):
+        path = os.path.join(self.root, bucket_name)
+        return self._buckets.setdefault(bucket_name, LocalBucket(bucket_name, path))
+
+    def list_blobs(self, bucket_or_name, prefix=None):
+        bucket = bucket_or_name if isinstance(bucket_or_name, LocalBucket) else self.bucket(bucket_or_name)
+        return bucket.list_blobs(prefix=prefix)
@@ -1,12 +1,19 @@
 import os
 import argparse
 import re
+import tempfile
 import wave
 import math
+import time
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from google.cloud import language_v1
 from google.cloud import vision_v1 as vision
 from google.cloud import speech_v1 as speech
+from gcs_staging import get_staging_manager
+from audio_levels import MAX_PAUSE_SECONDS, trim_silence
+from irony_fusion import IronyFusionScorer, columns_from_results
 
 # Funzione per configurare le credenziali Google Cloud
 def setup_credentials(credentials_path):
@@ -18,64 +25,238 @@ def setup_credentials(credentials_path):
         print("⚠️ Nessun file di credenziali specificato. Assicurati che le credenziali siano configurate nell'ambiente.")
 
 ### 🔍 1. Analisi del Sentiment e Ironia nel Testo ###
-def analyze_text_sentiment(text):
-    """Analizza il sentiment e rileva potenziale ironia nel testo"""
-    try:
-        client = language_v1.LanguageServiceClient()
-        document = language_v1.Document(content=text, type_=language_v1.Document.Type.PLAIN_TEXT)
-        
-        sentiment = client.analyze_sentiment(request={"document": document}).document_sentiment
+
+# Dimensione massima (in byte UTF-8) di un documento inviato all'API Natural Language
+MAX_DOCUMENT_BYTES = 1000000
+
+# Pattern tipici dell'ironia
+IRONY_PATTERNS = [re.compile(pattern) for pattern in [
+    r'\.{3}|…',              # Punti di sospensione
+    r'proprio il massimo',   # Frasi sarcastiche comuni
+    r'che bello',
+    r'fantastico\W.+negativo', # Contrasto tra positivo e negativo
+    r'adoro\W.+dopo',         # Schema "positivo... dopo" (come nel tuo esempio)
+    r'migliore\W.+dopo',      # Schema "migliore... dopo"
+    r'!\?|\?!',               # Combinazione di punti esclamativi e interrogativi
+]]
+
+# Parole per il contrasto semantico
+POSITIVE_WORDS = ['adoro', 'migliore', 'fantastico', 'bellissimo', 'perfetto']
+NEGATIVE_WORDS = ['calcio', 'stinchi', 'traffico', 'bloccato', 'terribile', 'orribile']
+
+# Soglia di score oltre la quale una frase è considerata nettamente positiva/negativa
+SENTENCE_POLARITY_THRESHOLD = 0.3
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?…])\s+')
+
+def _detect_sarcasm(text, score, magnitude, sentences=None):
+    """
+    Applica le euristiche sull'ironia e restituisce il numero di indizi trovati.
+    Se sono disponibili le frasi, il contrasto semantico viene cercato tra frasi
+    vicine invece che sull'intero testo.
+    """
+    hits = 0
+    lowered = text.lower()
+    
+    # Metodo 1: Sentiment positivo con magnitude sufficiente (ridotta a 0.8)
+    if score > 0 and magnitude > 0.8:
+        hits += 1
         
-        # Euristiche migliorate per il rilevamento dell'ironia
-        sarcasm_detected = False
+    # Metodo 2: Cerca pattern tipici dell'ironia
+    hits += sum(1 for pattern in IRONY_PATTERNS if pattern.search(lowered))
+    
+    # Metodo 3: Contrasto semantico (parole positive seguite da negative)
+    if sentences and len(sentences) > 1:
+        # Una frase positiva accanto a una negativa, per parole o per sentiment
+        def polarity(sentence):
+            sentence_text = sentence["text"].lower()
+            positive = any(word in sentence_text for word in POSITIVE_WORDS) or \
+                sentence["score"] >= SENTENCE_POLARITY_THRESHOLD
+            negative = any(word in sentence_text for word in NEGATIVE_WORDS) or \
+                sentence["score"] <= -SENTENCE_POLARITY_THRESHOLD
+            return positive, negative
         
-        # Metodo 1: Sentiment positivo con magnitude sufficiente (ridotta a 0.8)
-        if sentiment.score > 0 and sentiment.magnitude > 0.8:
-            sarcasm_detected = True
-            
-        # Metodo 2: Cerca pattern tipici dell'ironia
-        irony_patterns = [
-            r'\.{3}|…',              # Punti di sospensione
-            r'proprio il massimo',   # Frasi sarcastiche comuni
-            r'che bello',
-            r'fantastico\W.+negativo', # Contrasto tra positivo e negativo
-            r'adoro\W.+dopo',         # Schema "positivo... dopo" (come nel tuo esempio)
-            r'migliore\W.+dopo',      # Schema "migliore... dopo"
-            r'!\?|\?!',               # Combinazione di punti esclamativi e interrogativi
-        ]
+        polarities = [polarity(sentence) for sentence in sentences]
+        for (pos_a, neg_a), (pos_b, neg_b) in zip(polarities, polarities[1:]):
+            if (pos_a and neg_b) or (neg_a and pos_b):
+                hits += 1
+                break
+        else:
+            if any(pos and neg for pos, neg in polarities):
+                hits += 1
+    else:
+        has_positive = any(word in lowered for word in POSITIVE_WORDS)
+        has_negative = any(word in lowered for word in NEGATIVE_WORDS)
         
-        for pattern in irony_patterns:
-            if re.search(pattern, text.lower()):
-                sarcasm_detected = True
+        if has_positive and has_negative:
+            hits += 1
+    
+    return hits
+
+def _hard_split(text, start, end, max_bytes):
+    """
+    Posizioni di taglio di una frase più lunga di max_bytes: all'ultimo spazio
+    entro il limite oppure, se non ce ne sono, all'ultimo carattere che ci sta.
+    """
+    while start < end:
+        cut = start
+        size = 0
+        last_space = None
+        while cut < end:
+            char_bytes = len(text[cut].encode("utf-8"))
+            if size + char_bytes > max_bytes:
                 break
-                
-        # Metodo 3: Contrasto semantico (parole positive seguite da negative)
-        positive_words = ['adoro', 'migliore', 'fantastico', 'bellissimo', 'perfetto']
-        negative_words = ['calcio', 'stinchi', 'traffico', 'bloccato', 'terribile', 'orribile']
+            size += char_bytes
+            cut += 1
+            if text[cut - 1].isspace():
+                last_space = cut
+        if cut < end:
+            # Almeno un carattere per blocco, anche con max_bytes minore di un carattere
+            cut = max(last_space or cut, start + 1)
+        yield cut
+        start = cut
+
+def _split_document(text, max_bytes=MAX_DOCUMENT_BYTES):
+    """
+    Divide il testo in blocchi sotto max_bytes, tagliando ai confini di frase;
+    le frasi più lunghe di max_bytes vengono tagliate agli spazi o tra i caratteri.
+    Restituisce una lista di coppie (offset, blocco).
+    """
+    chunks = []
+    start = 0
+    chunk_start = 0
+    chunk_bytes = 0
+    
+    # Confini di frase come posizioni nel testo originale, così gli offset restano validi
+    boundaries = [match.end() for match in SENTENCE_BOUNDARY.finditer(text)] + [len(text)]
+    for boundary in boundaries:
+        ends = [boundary]
+        if len(text[start:boundary].encode("utf-8")) > max_bytes:
+            ends = _hard_split(text, start, boundary, max_bytes)
+        for end in ends:
+            piece_bytes = len(text[start:end].encode("utf-8"))
+            if chunk_bytes and chunk_bytes + piece_bytes > max_bytes:
+                chunks.append((chunk_start, text[chunk_start:start]))
+                chunk_start = start
+                chunk_bytes = 0
+            chunk_bytes += piece_bytes
+            start = end
+    if chunk_start < len(text) or not chunks:
+        chunks.append((chunk_start, text[chunk_start:]))
+    return chunks
+
+def _annotate_chunk(client, text, include_entities):
+    """Richiede sentiment del documento, delle frasi ed eventualmente le entità in una sola chiamata"""
+    document = language_v1.Document(content=text, type_=language_v1.Document.Type.PLAIN_TEXT)
+    features = language_v1.AnnotateTextRequest.Features(
+        extract_document_sentiment=True,
+        extract_entities=include_entities
+    )
+    # UTF32: gli offset delle frasi coincidono con gli indici delle stringhe Python
+    return client.annotate_text(request={
+        "document": document,
+        "features": features,
+        "encoding_type": language_v1.EncodingType.UTF32
+    })
+
+def _annotate_text(client, text, include_entities=False, max_bytes=MAX_DOCUMENT_BYTES):
+    """
+    Analizza il testo con annotate_text, dividendo i documenti troppo grandi e
+    analizzando i blocchi in parallelo. Score e magnitude vengono riaggregati:
+    lo score è la media pesata sulla lunghezza dei blocchi, la magnitude (che
+    cresce con la quantità di testo emotivo) è la loro somma.
+    """
+    chunks = _split_document(text, max_bytes)
+    
+    if len(chunks) == 1:
+        responses = [_annotate_chunk(client, text, include_entities)]
+    else:
+        print(f"✂️ Documento diviso in {len(chunks)} blocchi, analisi in parallelo...")
+        with ThreadPoolExecutor(max_workers=min(8, len(chunks))) as executor:
+            responses = list(executor.map(lambda chunk: _annotate_chunk(client, chunk[1], include_entities), chunks))
+    
+    total_length = sum(len(chunk) for _, chunk in chunks) or 1
+    score = 0.0
+    magnitude = 0.0
+    sentences = []
+    entities = {}
+    
+    for (offset, chunk), response in zip(chunks, responses):
+        weight = len(chunk) / total_length
+        score += response.document_sentiment.score * weight
+        magnitude += response.document_sentiment.magnitude
         
-        has_positive = any(word in text.lower() for word in positive_words)
-        has_negative = any(word in text.lower() for word in negative_words)
+        for sentence in response.sentences:
+            sentences.append({
+                "text": sentence.text.content,
+                "begin_offset": offset + sentence.text.begin_offset,
+                "score": sentence.sentiment.score,
+                "magnitude": sentence.sentiment.magnitude
+            })
         
-        if has_positive and has_negative:
-            sarcasm_detected = True
+        for entity in response.entities:
+            key = (entity.name, entity.type_.name)
+            merged = entities.setdefault(key, {"name": key[0], "type": key[1], "salience": 0.0, "mentions": 0})
+            merged["salience"] += entity.salience * weight
+            merged["mentions"] += len(entity.mentions)
+    
+    return score, magnitude, sentences, sorted(entities.values(), key=lambda e: e["salience"], reverse=True)
+
+def analyze_text_sentiment(text, sentence_level=False, include_entities=False):
+    """
+    Analizza il sentiment e rileva potenziale ironia nel testo.
+    Con sentence_level=True restituisce anche il sentiment di ogni frase, con
+    include_entities=True anche le entità, sempre con una sola chiamata per blocco.
+    """
+    try:
+        client = language_v1.LanguageServiceClient()
+        
+        result = {}
+        sentences = None
+        if sentence_level or include_entities or len(text.encode("utf-8")) > MAX_DOCUMENT_BYTES:
+            score, magnitude, sentences, entities = _annotate_text(client, text, include_entities)
+            if sentence_level:
+                result["sentences"] = sentences
+            if include_entities:
+                result["entities"] = entities
+        else:
+            document = language_v1.Document(content=text, type_=language_v1.Document.Type.PLAIN_TEXT)
+            sentiment = client.analyze_sentiment(request={"document": document}).document_sentiment
+            score, magnitude = sentiment.score, sentiment.magnitude
+        
+        # Euristiche migliorate per il rilevamento dell'ironia
+        irony_hits = _detect_sarcasm(text, score, magnitude, sentences)
         
         return {
-            "score": sentiment.score,
-            "magnitude": sentiment.magnitude,
-            "sarcasm_detected": sarcasm_detected
+            "score": score,
+            "magnitude": magnitude,
+            "sarcasm_detected": irony_hits > 0,
+            "irony_hits": irony_hits,
+            **result
         }
     except Exception as e:
         print(f"❌ Errore nell'analisi del testo: {e}")
-        return {"score": 0, "magnitude": 0, "sarcasm_detected": False}
+        return {"score": 0, "magnitude": 0, "sarcasm_detected": False, "irony_hits": 0, "error": str(e)}
 
 ### 🖼 2. Analisi delle Espressioni Facciali da Immagine ###
-def analyze_face_expression(image_path):
-    """Analizza le espressioni facciali in un'immagine"""
+def _prefiltered_no_face():
+    """Risultato per le immagini scartate dal prefiltro locale, uguale al caso 'nessun volto' di Vision"""
+    return {"error": "Nessun volto rilevato", "prefiltered": True}
+
+def analyze_face_expression(image_path, prefilter=None):
+    """
+    Analizza le espressioni facciali in un'immagine.
+    Se viene passato un FacePrefilter, le immagini senza volti evidenti non vengono inviate a Vision.
+    """
     if image_path.lower() == 'none':
         print("⏩ Analisi dell'immagine saltata")
         return {"error": "Analisi saltata"}
         
     try:
+        if prefilter is not None and not prefilter.has_face(image_path):
+            print("⚠️ Nessun volto rilevato dal prefiltro locale, chiamata a Vision evitata")
+            return _prefiltered_no_face()
+        
         client = vision.ImageAnnotatorClient()
 
         with open(image_path, "rb") as image_file:
@@ -112,102 +293,150 @@ def analyze_face_expression(image_path):
         print(f"❌ Errore nell'analisi dell'immagine: {e}")
         return {"error": str(e)}
 
-def transcribe_audio(audio_path, language_code="it-IT"):
+def analyze_face_expressions(image_paths, prefilter=None, max_workers=None):
     """
-    Trascrive l'audio e restituisce il testo, supportando file di qualsiasi lunghezza
-    usando Google Cloud Storage per file lunghi
+    Analizza un insieme di immagini. Il prefiltro locale (se presente) gira in un
+    pool di processi sull'intero batch e solo le immagini che lo superano vanno a Vision.
     """
-    if audio_path.lower() == 'none':
-        print("⏩ Analisi dell'audio saltata")
-        return {"error": "Analisi saltata"}
-        
-    try:
-        if not audio_path.lower().endswith(('.wav')):
-            return {"error": "Il file deve essere in formato WAV per l'analisi"}
-        
-        # Importa la libreria storage
-        from google.cloud import storage
-            
-        # Apre il file WAV e legge le proprietà
-        with wave.open(audio_path, 'rb') as wav:
-            channels = wav.getnchannels()
-            sample_width = wav.getsampwidth()
-            frame_rate = wav.getframerate()
-            n_frames = wav.getnframes()
-            file_duration = n_frames / frame_rate
-            
-        print(f"🔊 Elaborazione audio di {file_duration:.1f} secondi")
-        
-        # Converti da stereo a mono se necessario
-        temp_file = f"temp_{os.path.basename(audio_path)}"
-        
-        if channels == 2:
-            print("🔄 Conversione da stereo a mono in corso...")
-            
-            with wave.open(audio_path, 'rb') as wav:
-                # Legge tutti i frame
-                wav.setpos(0)
-                audio_data = wav.readframes(n_frames)
-                
-                # Converte i bytes in un array numpy
-                audio_array = np.frombuffer(audio_data, dtype=np.int16)
-                
-                # Rimodella l'array per avere 2 canali
-                audio_array = audio_array.reshape(-1, channels)
-                
-                # Calcola la media dei canali per ottenere mono
-                mono_array = audio_array.mean(axis=1).astype(np.int16)
-                
-                # Scrivi un nuovo file WAV mono
-                with wave.open(temp_file, 'wb') as mono_wav:
-                    mono_wav.setnchannels(1)  # 1 canale (mono)
-                    mono_wav.setsampwidth(sample_width)
-                    mono_wav.setframerate(frame_rate)
-                    mono_wav.writeframes(mono_array.tobytes())
-                    
-            file_to_analyze = temp_file
-            conversion_note = "Audio convertito da stereo a mono"
-        else:
-            # Se è già mono, utilizziamo direttamente il file originale
-            file_to_analyze = audio_path
-            conversion_note = "Audio in formato mono"
-        
-        # Carica il file su Google Cloud Storage (GCS)
-        print("🔄 Caricamento del file su Google Cloud Storage...")
-        
-        # Crea un client Storage
-        storage_client = storage.Client()
-        
-        # Nome del bucket - assicurati che esista o che l'account di servizio possa crearlo
-        bucket_name = "audio_analysis_temp"
-        
-        # Verifica se il bucket esiste, altrimenti crealo
-        try:
-            bucket = storage_client.get_bucket(bucket_name)
-        except Exception:
-            print(f"⚠️ Bucket {bucket_name} non trovato, creazione in corso...")
-            bucket = storage_client.create_bucket(bucket_name)
+    if prefilter is not None:
+        to_analyze = prefilter.filter_batch(image_paths, max_workers)
+        stats = prefilter.stats()
+        print(f"🔎 Prefiltro: {stats['calls_avoided']} chiamate a Vision evitate su {stats['images_checked']} immagini")
+    else:
+        to_analyze = [True] * len(image_paths)
+    
+    return [
+        analyze_face_expression(path) if keep else _prefiltered_no_face()
+        for path, keep in zip(image_paths, to_analyze)
+    ]
+
+def _downmix_to_mono(audio_array, channels):
+    """Converte campioni int16 interlacciati in mono facendo la media dei canali"""
+    # Rimodella l'array per avere un canale per colonna
+    audio_array = audio_array.reshape(-1, channels)
+    
+    # Calcola la media dei canali per ottenere mono
+    return audio_array.mean(axis=1).astype(np.int16)
+
+def _decode_pcm16(audio_data, sample_width):
+    """Converte i campioni PCM del WAV (8, 16, 24 o 32 bit) in int16, il formato LINEAR16 dell'API"""
+    if sample_width == 1:
+        # I WAV a 8 bit sono senza segno, centrati su 128
+        return ((np.frombuffer(audio_data, dtype=np.uint8).astype(np.int16) - 128) << 8).astype(np.int16)
+    if sample_width == 2:
+        return np.frombuffer(audio_data, dtype="<i2")
+    if sample_width == 3:
+        # Little endian: i due byte più significativi di ogni campione formano l'int16
+        return np.frombuffer(audio_data, dtype=np.uint8).reshape(-1, 3)[:, 1:].copy().view("<i2").ravel()
+    if sample_width == 4:
+        return (np.frombuffer(audio_data, dtype="<i4") >> 16).astype(np.int16)
+    raise ValueError(f"Campioni a {sample_width * 8} bit non supportati")
+
+def _prepare_audio(audio_path, max_pause=MAX_PAUSE_SECONDS):
+    """
+    Legge il WAV, lo converte in mono se necessario e rimuove i tratti di silenzio
+    (iniziale, finale e pause interne più lunghe di max_pause secondi). Se l'audio
+    è modificato viene scritto in un file mono temporaneo; se è silenzioso
+    'silent' è True e il file non va inviato all'API.
+    """
+    # Apre il file WAV, legge le proprietà e tutti i frame
+    with wave.open(audio_path, 'rb') as wav:
+        channels = wav.getnchannels()
+        sample_width = wav.getsampwidth()
+        frame_rate = wav.getframerate()
+        n_frames = wav.getnframes()
+        file_duration = n_frames / frame_rate
+        audio_data = wav.readframes(n_frames)
         
-        # Genera un nome file unico
-        import time
-        blob_name = f"audio_{int(time.time())}_{os.path.basename(file_to_analyze)}"
+    print(f"🔊 Elaborazione audio di {file_duration:.1f} secondi")
+    
+    # Converte i bytes in un array numpy di campioni a 16 bit
+    audio_array = _decode_pcm16(audio_data, sample_width)
+    
+    # Converti da stereo a mono se necessario
+    if channels > 1:
+        print("🔄 Conversione da stereo a mono in corso...")
+        audio_array = _downmix_to_mono(audio_array, channels)
+        conversion_note = "Audio convertito da stereo a mono"
+    else:
+        conversion_note = "Audio in formato mono"
+    if sample_width != 2:
+        conversion_note += f", convertito da {sample_width * 8} a 16 bit"
+    
+    # Analisi dei livelli: taglia il silenzio che verrebbe comunque fatturato
+    trimmed_array, levels = trim_silence(audio_array, frame_rate, max_pause=max_pause)
+    
+    prepared = {
+        "path": audio_path,
+        "temp_file": None,
+        "frame_rate": frame_rate,
+        "duration": levels["duration"],
+        "original_duration": file_duration,
+        "silent": levels["silent"],
+        "note": conversion_note
+    }
+    
+    if levels["silent"]:
+        print(f"🔇 Audio silenzioso (picco {levels['peak_dbfs']:.1f} dBFS), trascrizione non necessaria")
+        return prepared
+    
+    if channels > 1 or sample_width != 2 or len(trimmed_array) < len(audio_array):
+        if len(trimmed_array) < len(audio_array):
+            print(f"✂️ Silenzio rimosso: {file_duration:.1f}s → {levels['duration']:.1f}s")
         
-        # Carica il file su GCS
-        blob = bucket.blob(blob_name)
-        blob.upload_from_filename(file_to_analyze)
+        # File temporaneo con nome univoco: più trascrizioni possono essere in corso insieme
+        fd, temp_file = tempfile.mkstemp(prefix="temp_", suffix=".wav")
+        os.close(fd)
         
-        # Ottieni l'URI GCS
-        gcs_uri = f"gs://{bucket_name}/{blob_name}"
-        print(f"✅ File caricato su: {gcs_uri}")
+        # Scrivi un nuovo file WAV mono a 16 bit
+        with wave.open(temp_file, 'wb') as mono_wav:
+            mono_wav.setnchannels(1)  # 1 canale (mono)
+            mono_wav.setsampwidth(2)
+            mono_wav.setframerate(frame_rate)
+            mono_wav.writeframes(trimmed_array.tobytes())
         
+        prepared["path"] = temp_file
+        prepared["temp_file"] = temp_file
+    
+    return prepared
+
+def _silent_audio_result(prepared):
+    """Risultato per un audio silenzioso, per cui l'API non viene chiamata"""
+    return {
+        "transcript": "",
+        "confidence": 0,
+        "note": f"Audio silenzioso, trascrizione non richiesta. {prepared['note']} "
+                f"(durata originale {prepared['original_duration']:.1f} secondi, fatturati 0.0 secondi)"
+    }
+
+def _cleanup_prepared_audio(prepared):
+    """Elimina il file temporaneo locale se è stato creato"""
+    temp_file = prepared.get("temp_file") if prepared else None
+    if temp_file and os.path.exists(temp_file):
+        os.remove(temp_file)
+
+def start_transcription(prepared, language_code="it-IT", client=None):
+    """
+    Carica l'audio preparato su GCS e avvia la trascrizione asincrona.
+    Restituisce l'operazione a lunga durata e il riferimento al file su GCS.
+    """
+    # Carica il file su Google Cloud Storage (GCS)
+    print("🔄 Caricamento del file su Google Cloud Storage...")
+    
+    # Il manager condiviso risolve il bucket una sola volta e usa nomi basati sul contenuto
+    staging = get_staging_manager()
+    staged = staging.stage(prepared["path"])
+    print(f"✅ File caricato su: {staged.uri}")
+    
+    try:
         # Utilizza l'API Speech con riferimento GCS
-        client = speech.SpeechClient()
+        client = client or speech.SpeechClient()
         
-        audio = speech.RecognitionAudio(uri=gcs_uri)
+        audio = speech.RecognitionAudio(uri=staged.uri)
         
         config = speech.RecognitionConfig(
             encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-            sample_rate_hertz=frame_rate,
+            sample_rate_hertz=prepared["frame_rate"],
             language_code=language_code,
             audio_channel_count=1,
             enable_automatic_punctuation=True,
@@ -216,48 +445,94 @@ def transcribe_audio(audio_path, language_code="it-IT"):
         # Usa l'API asincrona per file lunghi
         print("⏳ Avvio trascrizione con GCS...")
         operation = client.long_running_recognize(config=config, audio=audio)
+    except Exception:
+        staging.release(staged)
+        raise
+    
+    return operation, staged
+
+def build_transcription_result(response, conversion_note, file_duration, original_duration=None):
+    """Converte la risposta di long_running_recognize nel dizionario dei risultati"""
+    if original_duration is None:
+        original_duration = file_duration
+    durations = f"durata originale {original_duration:.1f} secondi, fatturati {file_duration:.1f} secondi"
+    
+    if response.results:
+        transcript = " ".join([result.alternatives[0].transcript for result in response.results])
+        confidence = response.results[0].alternatives[0].confidence
+        
+        return {
+            "transcript": transcript, 
+            "confidence": confidence, 
+            "note": f"{conversion_note}, analizzato via GCS ({durations})"
+        }
+    return {
+        "transcript": "", 
+        "confidence": 0, 
+        "note": f"Nessun risultato. {conversion_note}, analizzato via GCS ({durations})"
+    }
+
+def transcribe_audio(audio_path, language_code="it-IT", max_pause=MAX_PAUSE_SECONDS):
+    """
+    Trascrive l'audio e restituisce il testo, supportando file di qualsiasi lunghezza
+    usando Google Cloud Storage per file lunghi. Il silenzio viene rimosso prima del
+    caricamento e i file silenziosi non vengono inviati all'API.
+    """
+    if audio_path.lower() == 'none':
+        print("⏩ Analisi dell'audio saltata")
+        return {"error": "Analisi saltata"}
+        
+    prepared = None
+    staged = None
+    try:
+        if not audio_path.lower().endswith(('.wav')):
+            return {"error": "Il file deve essere in formato WAV per l'analisi"}
+        
+        prepared = _prepare_audio(audio_path, max_pause)
+        if prepared["silent"]:
+            return _silent_audio_result(prepared)
+        
+        operation, staged = start_transcription(prepared, language_code)
+        
+        # Il file locale non serve più una volta caricato su GCS
+        _cleanup_prepared_audio(prepared)
+        
         print("⏳ Elaborazione in corso, attendere...")
         response = operation.result(timeout=900)  # Timeout di 15 minuti
         
-        # Elimina il file da GCS
-        blob.delete()
-        print("✅ File temporaneo eliminato da GCS")
+        # Elimina il file da GCS in background, fuori dal percorso critico
+        get_staging_manager().release(staged)
+        staged = None
         
         # Elabora i risultati
-        if response.results:
-            transcript = " ".join([result.alternatives[0].transcript for result in response.results])
-            confidence = response.results[0].alternatives[0].confidence
-            
-            success_result = {
-                "transcript": transcript, 
-                "confidence": confidence, 
-                "note": f"{conversion_note}, file completo analizzato via GCS ({file_duration:.1f} secondi)"
-            }
-        else:
-            success_result = {
-                "transcript": "", 
-                "confidence": 0, 
-                "note": f"Nessun risultato. {conversion_note}, file completo analizzato via GCS"
-            }
-        
-        # Elimina il file temporaneo locale se è stato creato
-        if channels == 2 and os.path.exists(temp_file):
-            os.remove(temp_file)
-        
-        return success_result
+        return build_transcription_result(response, prepared["note"], prepared["duration"], prepared["original_duration"])
             
     except FileNotFoundError:
         print(f"❌ File audio non trovato: {audio_path}")
         return {"error": "File non trovato"}
     except Exception as e:
         print(f"❌ Errore nell'analisi audio: {e}")
-        # Pulisci i file temporanei in caso di errore
-        if 'temp_file' in locals() and os.path.exists(temp_file):
-            os.remove(temp_file)
+        # Rilascia il file su GCS e pulisci i file temporanei in caso di errore
+        if staged:
+            get_staging_manager().release(staged)
+        _cleanup_prepared_audio(prepared)
         return {"error": str(e)}
 
+@lru_cache(maxsize=1)
+def _irony_scorer():
+    return IronyFusionScorer.from_config()
+
+def estimate_irony_score(text_analysis, image_analysis=None, transcript_sentiment=None):
+    """Punteggio di ironia (0-1) che combina testo, espressioni del volto e sentiment della trascrizione"""
+    batch = columns_from_results([text_analysis], [image_analysis], [transcript_sentiment])
+    return float(_irony_scorer().score(batch)[0])
+
+def irony_score_label():
+    """Etichetta del punteggio: è una probabilità solo se i pesi sono stati calibrati"""
+    return "Probabilità di ironia" if _irony_scorer().calibrated else "Indice di ironia (non calibrato)"
+
 def display_results(text_analysis, image_analysis, audio_analysis, text_content):
-    """Visualizza in modo ordinato i risultati dell'analisi"""
+    """Visualizza in modo ordinato i risultati dell'analisi e restituisce il sentiment della trascrizione"""
     
     print("\n" + "="*50)
     print("📊 RISULTATI DELL'ANALISI")
@@ -269,6 +544,14 @@ def display_results(text_analysis, image_analysis, audio_analysis, text_content)
     print(f"📊 Sentiment score: {text_analysis['score']:.2f} (-1 negativo, +1 positivo)")
     print(f"📏 Magnitude: {text_analysis['magnitude']:.2f} (intensità dell'emozione)")
     print(f"🎭 Ironia/sarcasmo rilevato: {'✅ Sì' if text_analysis['sarcasm_detected'] else '❌ No'}")
+    if text_analysis.get('source'):
+        print(f"🧭 Fonte: {'modello locale' if text_analysis['source'] == 'local' else 'API Google'}")
+    if text_analysis.get('sentences'):
+        print("🧩 Sentiment per frase:")
+        for sentence in text_analysis['sentences']:
+            print(f"   {sentence['score']:+.2f} | {sentence['text']}")
+    if text_analysis.get('entities'):
+        print(f"🏷️ Entità: {', '.join(entity['name'] for entity in text_analysis['entities'])}")
     
     # Visualizza analisi immagine
     print("\n📸 ANALISI DELL'IMMAGINE:")
@@ -283,6 +566,7 @@ def display_results(text_analysis, image_analysis, audio_analysis, text_content)
             print(f"🔍 Confidenza rilevamento: {image_analysis['detection_confidence']:.2f}")
     
     # Visualizza analisi audio
+    audio_sentiment = None
     print("\n🎤 ANALISI DELL'AUDIO:")
     if "error" in audio_analysis:
         print(f"❌ Errore: {audio_analysis['error']}")
@@ -292,7 +576,7 @@ def display_results(text_analysis, image_analysis, audio_analysis, text_content)
         print(f"🔍 Confidenza: {audio_analysis.get('confidence', 0):.2f}")
         
         if audio_analysis['transcript']:
-            audio_sentiment = analyze_text_sentiment(audio_analysis['transcript'])
+            audio_sentiment = analyze_text_sentiment(audio_analysis['transcript'], sentence_level=True)
             print(f"📊 Sentiment della trascrizione: {audio_sentiment['score']:.2f}")
             print(f"📏 Magnitude della trascrizione: {audio_sentiment['magnitude']:.2f}")
             print(f"🎭 Ironia/sarcasmo nella trascrizione: {'✅ Sì' if audio_sentiment['sarcasm_detected'] else '❌ No'}")
@@ -302,12 +586,120 @@ def display_results(text_analysis, image_analysis, audio_analysis, text_content)
         
         # Se abbiamo ottenuto una trascrizione, analizziamo anche il suo sentiment
         if audio_analysis['transcript']:
-            audio_sentiment = analyze_text_sentiment(audio_analysis['transcript'])
+            audio_sentiment = analyze_text_sentiment(audio_analysis['transcript'], sentence_level=True)
             print(f"📊 Sentiment della trascrizione: {audio_sentiment['score']:.2f}")
             print(f"📏 Magnitude della trascrizione: {audio_sentiment['magnitude']:.2f}")
             print(f"🎭 Ironia/sarcasmo nella trascrizione: {'✅ Sì' if audio_sentiment['sarcasm_detected'] else '❌ No'}")
     
+    # Stima combinata dell'ironia a partire da tutte le modalità
+    print("\n🧮 FUSIONE MULTIMODALE:")
+    irony_score = estimate_irony_score(text_analysis, image_analysis, audio_sentiment)
+    print(f"🎭 {irony_score_label()}: {irony_score:.0%}")
+    
     print("\n" + "="*50)
+    return audio_sentiment
+
+def build_face_prefilter(threshold):
+    """Crea il prefiltro locale dei volti, o None se non richiesto o se opencv non è installato"""
+    if threshold is None:
+        return None
+    try:
+        from face_prefilter import FacePrefilter
+        return FacePrefilter(threshold=threshold)
+    except ImportError:
+        print("⚠️ opencv non installato (requirements-prefilter.txt), prefiltro dei volti disattivato")
+        return None
+
+@lru_cache(maxsize=None)
+def _local_cascade(neutral_band, sentence_level):
+    from local_sentiment import SentimentCascade
+    
+    api_fn = partial(analyze_text_sentiment, sentence_level=sentence_level, include_entities=sentence_level)
+    return SentimentCascade(neutral_band=neutral_band, api_fn=api_fn)
+
+def analyze_text_local_first(text, neutral_band, sentence_level=False):
+    """Sentiment con il modello locale, inviando all'API solo i testi incerti"""
+    from local_sentiment import format_stats
+    
+    cascade = _local_cascade(neutral_band, sentence_level)
+    result = cascade.analyze(text)
+    print(format_stats(cascade.stats()))
+    return result
+
+def record_history(runs, source="cli", started_at=None):
+    """
+    Salva nello storico locale le analisi eseguite, come tuple (modalità, testo o
+    percorso, risultato, sentiment della trascrizione). Un errore dello storico
+    non interrompe l'analisi.
+    """
+    from history import HistoryStore, input_digest
+    
+    try:
+        store = HistoryStore()
+        try:
+            for modality, value, result, sentiment in runs:
+                store.record(modality, input_digest(modality, value), result, source, sentiment, started_at)
+        finally:
+            store.close()
+    except Exception as e:
+        print(f"⚠️ Impossibile aggiornare lo storico: {e}")
+
+def _transcription_manager(with_history=True):
+    """Gestore dei job di trascrizione, che salva nello storico i job completati se richiesto"""
+    from transcription_jobs import TranscriptionJobManager
+    
+    history = None
+    if with_history:
+        from history import HistoryStore
+        history = HistoryStore()
+    return TranscriptionJobManager(history=history)
+
+def submit_transcription_job(audio_path, language_code, max_pause=MAX_PAUSE_SECONDS, with_history=True):
+    """Avvia la trascrizione senza attenderla e restituisce un risultato con il job id"""
+    try:
+        job_id = _transcription_manager(with_history).submit(audio_path, language_code, max_pause)
+    except FileNotFoundError:
+        print(f"❌ File audio non trovato: {audio_path}")
+        return {"error": "File non trovato"}
+    except Exception as e:
+        print(f"❌ Errore nell'avvio della trascrizione: {e}")
+        return {"error": str(e)}
+    
+    return {
+        "transcript": "",
+        "confidence": 0,
+        "note": f"Trascrizione in corso (job {job_id}), recupera il risultato con --job {job_id}"
+    }
+
+def show_transcription_job(job_id, with_history=True):
+    """Aggiorna lo stato dei job in corso (salvando nello storico quelli completati) e mostra il risultato del job richiesto"""
+    from job_store import STATUS_RUNNING
+    
+    manager = _transcription_manager(with_history)
+    manager.poll_once()
+    status = manager.status(job_id)
+    
+    print("\n🎤 TRASCRIZIONE IN BACKGROUND:")
+    if status is None:
+        print(f"❌ Job {job_id} non trovato")
+    elif status == STATUS_RUNNING:
+        print(f"⏳ Job {job_id} ancora in corso, riprova più tardi")
+    else:
+        result = manager.result(job_id)
+        if "error" in result:
+            print(f"❌ Errore: {result['error']}")
+        else:
+            print(f"⚠️ Nota: {result['note']}")
+            print(f"🔤 Trascrizione: \"{result['transcript']}\"")
+            print(f"🔍 Confidenza: {result.get('confidence', 0):.2f}")
+            
+            if result['transcript']:
+                audio_sentiment = analyze_text_sentiment(result['transcript'], sentence_level=True)
+                print(f"📊 Sentiment della trascrizione: {audio_sentiment['score']:.2f}")
+                print(f"📏 Magnitude della trascrizione: {audio_sentiment['magnitude']:.2f}")
+                print(f"🎭 Ironia/sarcasmo nella trascrizione: {'✅ Sì' if audio_sentiment['sarcasm_detected'] else '❌ No'}")
+                # L'esecuzione salvata dal poller non ha ancora il sentiment della trascrizione
+                manager.record_sentiment(job_id, audio_sentiment)
 
 def main():
     """Funzione principale che esegue l'analisi"""
@@ -320,21 +712,54 @@ def main():
     parser.add_argument("--image", default="test.jpg", help="Percorso al file immagine da analizzare (o 'none' per saltare)")
     parser.add_argument("--audio", default="test.wav", help="Percorso al file audio da analizzare (o 'none' per saltare)")
     parser.add_argument("--language", default="it-IT", help="Codice lingua per la trascrizione audio (default: it-IT)")
+    parser.add_argument("--face-prefilter", nargs="?", type=float, const=0.0, default=None, metavar="SOGLIA",
+                        help="Usa un rilevatore locale di volti prima di Vision (richiede opencv); soglia opzionale")
+    parser.add_argument("--sentences", action="store_true",
+                        help="Mostra il sentiment di ogni frase del testo e le entità rilevate")
+    parser.add_argument("--local-first", nargs="?", type=float, const=0.25, default=None, metavar="SOGLIA",
+                        help="Calcola il sentiment in locale e usa l'API solo per i testi incerti "
+                             "(score in valore assoluto sotto la soglia, default 0.25)")
+    parser.add_argument("--max-pause", type=float, default=MAX_PAUSE_SECONDS,
+                        help=f"Durata massima in secondi delle pause mantenute nell'audio (default: {MAX_PAUSE_SECONDS})")
+    parser.add_argument("--no-wait", action="store_true",
+                        help="Avvia la trascrizione in background e restituisce un job id invece di attendere")
+    parser.add_argument("--no-history", action="store_true",
+                        help="Non salvare le analisi nello storico locale (history.db)")
+    parser.add_argument("--job", help="Recupera il risultato di una trascrizione avviata con --no-wait")
     
     args = parser.parse_args()
     
     # Imposta le credenziali
     setup_credentials(args.credentials)
     
+    if args.job:
+        show_transcription_job(args.job, not args.no_history)
+        return
+    
     print("\n🚀 Avvio analisi...")
+    started_at = time.time()
     
     # Esegui le analisi
-    text_analysis = analyze_text_sentiment(args.text)
-    image_analysis = analyze_face_expression(args.image)
-    audio_analysis = transcribe_audio(args.audio, args.language)
+    if args.local_first is not None:
+        text_analysis = analyze_text_local_first(args.text, args.local_first, args.sentences)
+    else:
+        text_analysis = analyze_text_sentiment(args.text, sentence_level=args.sentences, include_entities=args.sentences)
+    image_analysis = analyze_face_expression(args.image, build_face_prefilter(args.face_prefilter))
+    if args.no_wait and args.audio.lower() != 'none':
+        audio_analysis = submit_transcription_job(args.audio, args.language, args.max_pause, not args.no_history)
+    else:
+        audio_analysis = transcribe_audio(args.audio, args.language, args.max_pause)
     
     # Visualizza i risultati
-    display_results(text_analysis, image_analysis, audio_analysis, args.text)
+    audio_sentiment = display_results(text_analysis, image_analysis, audio_analysis, args.text)
+    
+    if not args.no_history:
+        runs = [("text", args.text, text_analysis, None)]
+        if os.path.isfile(args.image):
+            runs.append(("image", args.image, image_analysis, None))
+        if os.path.isfile(args.audio) and not args.no_wait:
+            runs.append(("audio", args.audio, audio_analysis, audio_sentiment))
+        record_history(runs, started_at=started_at)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
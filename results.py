@@ -0,0 +1,245 @@
+import struct
+from abc import abstractmethod
+from enum import IntEnum
+from collections.abc import Mapping
+
+import numpy as np
+
+# Tipi compatti per i risultati delle analisi. Ogni tipo usa __slots__, salva le
+# likelihood come piccoli interi e ha una serializzazione binaria: un record a
+# dimensione fissa (struct) seguito dalle stringhe. Il record ha lo stesso layout
+# del dtype NumPy del tipo, per cui un buffer di record concatenati diventa un
+# array strutturato con np.frombuffer senza copie. La vista come Mapping
+# restituisce le stesse chiavi e gli stessi valori dei dizionari di main.py.
+
+FLAG_ERROR = 1
+FLAG_PREFILTERED = 2
+
+_LENGTH = struct.Struct("<I")
+
+
+class Likelihood(IntEnum):
+    """Scala di probabilità di Vision"""
+    UNKNOWN = 0
+    VERY_UNLIKELY = 1
+    UNLIKELY = 2
+    POSSIBLE = 3
+    LIKELY = 4
+    VERY_LIKELY = 5
+
+    @classmethod
+    def parse(cls, value):
+        """Converte un nome ('VERY_LIKELY') o un intero in Likelihood; valori sconosciuti diventano UNKNOWN"""
+        if isinstance(value, str):
+            return cls.__members__.get(value, cls.UNKNOWN)
+        try:
+            return cls(int(value))
+        except (TypeError, ValueError):
+            return cls.UNKNOWN
+
+
+def _pack_strings(*values):
+    parts = []
+    for value in values:
+        encoded = (value or "").encode("utf-8")
+        parts.append(_LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+    return b"".join(parts)
+
+
+def _unpack_strings(data, offset, count):
+    values = []
+    for _ in range(count):
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        values.append(bytes(data[offset:offset + length]).decode("utf-8"))
+        offset += length
+    return values
+
+
+class CompactResult(Mapping):
+    """Base dei risultati compatti: vista in sola lettura come dizionario e serializzazione"""
+
+    __slots__ = ()
+
+    STRUCT = None
+    DTYPE = None
+
+    @abstractmethod
+    def _items(self):
+        """Coppie (chiave, valore) della vista come dizionario"""
+
+    def as_dict(self):
+        return dict(self._items())
+
+    def __getitem__(self, key):
+        for name, value in self._items():
+            if name == key:
+                return value
+        raise KeyError(key)
+
+    def __iter__(self):
+        return (name for name, _ in self._items())
+
+    def __len__(self):
+        return len(self._items())
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.as_dict()!r})"
+
+    @abstractmethod
+    def record(self):
+        """Parte a dimensione fissa della serializzazione"""
+
+    @classmethod
+    def pack_records(cls, results):
+        """Concatena i record a dimensione fissa di più risultati (stringhe escluse)"""
+        return b"".join(result.record() for result in results)
+
+    @classmethod
+    def to_numpy(cls, buffer):
+        """Array strutturato che condivide la memoria del buffer di record"""
+        return np.frombuffer(buffer, dtype=cls.DTYPE)
+
+
+class TextResult(CompactResult):
+    """Sentiment di un testo: score, magnitude, numero di indizi di ironia ed eventuale errore"""
+
+    __slots__ = ("score", "magnitude", "irony_hits", "error")
+
+    STRUCT = struct.Struct("<ffHB")
+    DTYPE = np.dtype([("score", "<f4"), ("magnitude", "<f4"), ("irony_hits", "<u2"), ("flags", "u1")])
+
+    def __init__(self, score, magnitude, irony_hits=0, error=None):
+        self.score = float(score)
+        self.magnitude = float(magnitude)
+        self.irony_hits = int(irony_hits)
+        self.error = error
+
+    @property
+    def sarcasm_detected(self):
+        return self.irony_hits > 0
+
+    @classmethod
+    def from_dict(cls, result):
+        # I risultati con errore di main.py hanno comunque score e magnitude neutri
+        return cls(result.get("score", 0.0), result.get("magnitude", 0.0),
+                   result.get("irony_hits", int(result.get("sarcasm_detected", False))),
+                   error=result.get("error"))
+
+    def _items(self):
+        items = [("score", self.score), ("magnitude", self.magnitude),
+                 ("sarcasm_detected", self.sarcasm_detected), ("irony_hits", self.irony_hits)]
+        if self.error is not None:
+            items.append(("error", self.error))
+        return items
+
+    def record(self):
+        return self.STRUCT.pack(self.score, self.magnitude, min(self.irony_hits, 0xFFFF),
+                                FLAG_ERROR if self.error is not None else 0)
+
+    def to_bytes(self):
+        return self.record() + _pack_strings(self.error)
+
+    @classmethod
+    def from_bytes(cls, data):
+        score, magnitude, irony_hits, flags = cls.STRUCT.unpack_from(data)
+        (error,) = _unpack_strings(data, cls.STRUCT.size, 1)
+        return cls(score, magnitude, irony_hits, error if flags & FLAG_ERROR else None)
+
+
+class FaceResult(CompactResult):
+    """Emozioni del primo volto rilevato, oppure l'errore dell'analisi"""
+
+    __slots__ = ("joy", "sorrow", "anger", "surprise", "detection_confidence", "error", "prefiltered")
+
+    EMOTIONS = ("joy", "sorrow", "anger", "surprise")
+    STRUCT = struct.Struct("<BBBBfB")
+    DTYPE = np.dtype([("joy", "u1"), ("sorrow", "u1"), ("anger", "u1"), ("surprise", "u1"),
+                      ("detection_confidence", "<f4"), ("flags", "u1")])
+
+    def __init__(self, joy=Likelihood.UNKNOWN, sorrow=Likelihood.UNKNOWN, anger=Likelihood.UNKNOWN,
+                 surprise=Likelihood.UNKNOWN, detection_confidence=0.0, error=None, prefiltered=False):
+        self.joy = Likelihood.parse(joy)
+        self.sorrow = Likelihood.parse(sorrow)
+        self.anger = Likelihood.parse(anger)
+        self.surprise = Likelihood.parse(surprise)
+        self.detection_confidence = float(detection_confidence)
+        self.error = error
+        self.prefiltered = bool(prefiltered)
+
+    @classmethod
+    def from_dict(cls, result):
+        if "error" in result:
+            return cls(error=result["error"], prefiltered=result.get("prefiltered", False))
+        return cls(*(result.get(emotion, "UNKNOWN") for emotion in cls.EMOTIONS),
+                   detection_confidence=result.get("detection_confidence", 0.0))
+
+    def likelihoods(self):
+        """Likelihood delle emozioni come {emozione: intero da 0 a 5}"""
+        return {emotion: int(getattr(self, emotion)) for emotion in self.EMOTIONS}
+
+    def _items(self):
+        if self.error is not None:
+            items = [("error", self.error)]
+            if self.prefiltered:
+                items.append(("prefiltered", True))
+            return items
+        items = [(emotion, getattr(self, emotion).name) for emotion in self.EMOTIONS]
+        items.append(("detection_confidence", self.detection_confidence))
+        return items
+
+    def _flags(self):
+        return (FLAG_ERROR if self.error is not None else 0) | (FLAG_PREFILTERED if self.prefiltered else 0)
+
+    def record(self):
+        return self.STRUCT.pack(self.joy, self.sorrow, self.anger, self.surprise,
+                                self.detection_confidence, self._flags())
+
+    def to_bytes(self):
+        return self.record() + _pack_strings(self.error)
+
+    @classmethod
+    def from_bytes(cls, data):
+        joy, sorrow, anger, surprise, confidence, flags = cls.STRUCT.unpack_from(data)
+        (error,) = _unpack_strings(data, cls.STRUCT.size, 1)
+        return cls(joy, sorrow, anger, surprise, confidence,
+                   error=error if flags & FLAG_ERROR else None, prefiltered=flags & FLAG_PREFILTERED)
+
+
+class AudioResult(CompactResult):
+    """Trascrizione di un audio, oppure l'errore dell'analisi"""
+
+    __slots__ = ("transcript", "confidence", "note", "error")
+
+    STRUCT = struct.Struct("<fB")
+    DTYPE = np.dtype([("confidence", "<f4"), ("flags", "u1")])
+
+    def __init__(self, transcript="", confidence=0.0, note="", error=None):
+        self.transcript = transcript
+        self.confidence = float(confidence)
+        self.note = note
+        self.error = error
+
+    @classmethod
+    def from_dict(cls, result):
+        if "error" in result:
+            return cls(error=result["error"])
+        return cls(result.get("transcript", ""), result.get("confidence", 0.0), result.get("note", ""))
+
+    def _items(self):
+        if self.error is not None:
+            return [("error", self.error)]
+        return [("transcript", self.transcript), ("confidence", self.confidence), ("note", self.note)]
+
+    def record(self):
+        return self.STRUCT.pack(self.confidence, FLAG_ERROR if self.error is not None else 0)
+
+    def to_bytes(self):
+        return self.record() + _pack_strings(self.transcript, self.note, self.error)
+
+    @classmethod
+    def from_bytes(cls, data):
+        confidence, flags = cls.STRUCT.unpack_from(data)
+        transcript, note, error = _unpack_strings(data, cls.STRUCT.size, 3)
+        return cls(transcript, confidence, note, error if flags & FLAG_ERROR else None)
@@ -0,0 +1,210 @@
+import time
+import uuid
+import threading
+from collections import OrderedDict, deque, Counter
+from concurrent.futures import ThreadPoolExecutor
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_ERROR = "error"
+
+
+class QueueSaturatedError(Exception):
+    """La coda (globale o della sessione) è piena e la richiesta è stata rifiutata"""
+
+
+class Task:
+    """Richiesta di analisi in coda o in esecuzione"""
+
+    __slots__ = ("task_id", "session_id", "api", "func", "args", "kwargs", "status",
+                 "result", "error", "submitted_at", "started_at", "finished_at")
+
+    def __init__(self, session_id, api, func, args, kwargs):
+        self.task_id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.api = api
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.status = STATUS_QUEUED
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in (STATUS_DONE, STATUS_ERROR)
+
+
+class FairTaskExecutor:
+    """
+    Executor condiviso da tutte le sessioni dell'app.
+
+    Ogni sessione ha la propria coda e le code vengono servite a turno
+    (round-robin), così una sessione con molte richieste non blocca le altre.
+    Ogni API ha un limite di chiamate contemporanee e le richieste oltre la
+    capacità delle code vengono rifiutate con QueueSaturatedError.
+    """
+
+    def __init__(self, max_workers=8, api_limits=None, max_queued=50, max_queued_per_session=3,
+                 finished_ttl=3600):
+        self.max_workers = max_workers
+        self.api_limits = dict(api_limits or {})
+        self.max_queued = max_queued
+        self.max_queued_per_session = max_queued_per_session
+        self.finished_ttl = finished_ttl
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis")
+        self._cond = threading.Condition()
+        self._sessions = OrderedDict()
+        self._tasks = {}
+        self._running = Counter()
+        self._queued = 0
+        self._closed = False
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="analysis-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, session_id, api, func, *args, **kwargs):
+        """Mette in coda func(*args, **kwargs) per la sessione e restituisce l'id del task"""
+        task = Task(session_id, api, func, args, kwargs)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Executor chiuso")
+            self._purge_expired()
+            queue = self._sessions.get(session_id)
+            if self._queued >= self.max_queued:
+                raise QueueSaturatedError("Troppe richieste in coda, riprova tra poco")
+            if queue is not None and len(queue) >= self.max_queued_per_session:
+                raise QueueSaturatedError("Hai già troppe analisi in coda, attendi che terminino")
+            if queue is None:
+                queue = self._sessions[session_id] = deque()
+            queue.append(task)
+            self._tasks[task.task_id] = task
+            self._queued += 1
+            self._cond.notify_all()
+        return task.task_id
+
+    def _purge_expired(self):
+        # Risultati mai ritirati (es. sessione chiusa) vengono dimenticati dopo finished_ttl secondi
+        expired = time.time() - self.finished_ttl
+        for task_id in [t.task_id for t in self._tasks.values() if t.finished and t.finished_at < expired]:
+            del self._tasks[task_id]
+
+    def poll(self, task_id):
+        """Restituisce il Task (o None se sconosciuto)"""
+        with self._cond:
+            return self._tasks.get(task_id)
+
+    def pop_finished(self, task_id):
+        """Restituisce il Task se terminato e smette di tenerne traccia, altrimenti None"""
+        with self._cond:
+            task = self._tasks.get(task_id)
+            if task is None or not task.finished:
+                return None
+            return self._tasks.pop(task_id)
+
+    def position(self, task_id):
+        """
+        Numero stimato di richieste, di tutte le sessioni, che verranno avviate prima
+        di questo task con il turno round-robin (senza considerare i limiti per API)
+        """
+        with self._cond:
+            task = self._tasks.get(task_id)
+            queue = self._sessions.get(task.session_id) if task else None
+            if not queue or task.status != STATUS_QUEUED:
+                return 0
+            # Il task è servito al turno numero `rounds` della propria sessione
+            rounds = list(queue).index(task)
+            ahead = 0
+            before_session = True
+            for session_id, other in self._sessions.items():
+                if session_id == task.session_id:
+                    before_session = False
+                    ahead += rounds
+                    continue
+                # Le sessioni che precedono nel turno vengono servite anche al turno `rounds`
+                ahead += min(len(other), rounds + 1 if before_session else rounds)
+            return ahead
+
+    def queue_depth(self):
+        """Richieste in coda e in esecuzione, in totale e per API"""
+        with self._cond:
+            return {
+                "queued": self._queued,
+                "running": sum(self._running.values()),
+                "running_by_api": dict(self._running),
+                "sessions": len(self._sessions)
+            }
+
+    def _has_capacity(self, api):
+        limit = self.api_limits.get(api)
+        return limit is None or self._running[api] < limit
+
+    def _next_task(self):
+        """Sceglie il prossimo task: prima sessione nel turno con un task la cui API ha posti liberi"""
+        if sum(self._running.values()) >= self.max_workers:
+            return None
+        for session_id, queue in self._sessions.items():
+            for task in queue:
+                if self._has_capacity(task.api):
+                    queue.remove(task)
+                    # La sessione servita passa in fondo al turno
+                    if queue:
+                        self._sessions.move_to_end(session_id)
+                    else:
+                        del self._sessions[session_id]
+                    return task
+        return None
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                task = self._next_task() if not self._closed else None
+                while task is None:
+                    if self._closed:
+                        return
+                    self._cond.wait()
+                    task = self._next_task() if not self._closed else None
+                self._queued -= 1
+                self._running[task.api] += 1
+                task.status = STATUS_RUNNING
+                task.started_at = time.time()
+            try:
+                self._pool.submit(self._run, task)
+            except RuntimeError:
+                # Il processo è in chiusura e il pool non accetta più lavoro
+                self._finish(task, STATUS_ERROR, error="Executor chiuso")
+                with self._cond:
+                    self._closed = True
+                return
+
+    def shutdown(self, wait=True):
+        """Ferma il dispatcher e il pool; le richieste ancora in coda non vengono eseguite"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._dispatcher is not threading.current_thread():
+            self._dispatcher.join()
+        self._pool.shutdown(wait=wait)
+
+    def _run(self, task):
+        try:
+            result = task.func(*task.args, **task.kwargs)
+        except Exception as e:
+            self._finish(task, STATUS_ERROR, error=str(e))
+        else:
+            self._finish(task, STATUS_DONE, result=result)
+
+    def _finish(self, task, status, result=None, error=None):
+        with self._cond:
+            task.result = result
+            task.error = error
+            task.status = status
+            task.finished_at = time.time()
+            task.func = task.args = task.kwargs = None
+            self._running[task.api] -= 1
+            if not self._running[task.api]:
+                del self._running[task.api]
+            self._cond.notify_all()
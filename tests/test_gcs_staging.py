@@ -0,0 +1,127 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gcs_staging import GCSStagingManager, file_digest
+from local_storage import LocalBlob, LocalStorageClient
+
+
+@pytest.fixture
+def manager(tmp_path):
+    client = LocalStorageClient(str(tmp_path / "gcs"))
+    manager = GCSStagingManager("bucket", client=client, parallel_threshold=1024, chunk_size=256)
+    yield manager
+    manager.shutdown()
+
+
+def write_file(path, size):
+    data = os.urandom(size)
+    path.write_bytes(data)
+    return str(path), data
+
+
+def blob_names(manager):
+    return [blob.name for blob in manager.bucket.list_blobs()]
+
+
+def test_stage_uploads_content_addressed_blob(manager, tmp_path):
+    path, data = write_file(tmp_path / "a.wav", 100)
+    staged = manager.stage(path)
+    assert staged.blob_name == f"audio/{file_digest(path)}.wav"
+    assert staged.uri == f"gs://bucket/{staged.blob_name}"
+    assert not staged.reused
+    assert manager.bucket.blob(staged.blob_name).download_as_bytes() == data
+
+
+def test_identical_files_reuse_blob_and_release_is_refcounted(manager, tmp_path):
+    first, _ = write_file(tmp_path / "a.wav", 100)
+    second = str(tmp_path / "b.wav")
+    with open(first, "rb") as src, open(second, "wb") as dst:
+        dst.write(src.read())
+
+    staged_a = manager.stage(first)
+    staged_b = manager.stage(second)
+    assert staged_b.reused
+    assert staged_a.blob_name == staged_b.blob_name
+
+    assert manager.release(staged_a) is None
+    assert manager.bucket.blob(staged_a.blob_name).exists()
+
+    manager.release(staged_b).result()
+    assert not manager.bucket.blob(staged_a.blob_name).exists()
+
+
+def test_concurrent_identical_parallel_uploads(manager, tmp_path):
+    path, data = write_file(tmp_path / "big.wav", 5000)
+    results, errors = [], []
+
+    def stage():
+        try:
+            results.append(manager.stage(path))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=stage) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    manager.shutdown()
+
+    assert not errors
+    assert len({staged.blob_name for staged in results}) == 1
+    assert manager.bucket.blob(results[0].blob_name).download_as_bytes() == data
+    assert blob_names(manager) == [results[0].blob_name]
+
+
+def test_failed_part_upload_removes_uploaded_parts(manager, tmp_path, monkeypatch):
+    path, _ = write_file(tmp_path / "big.wav", 5000)
+    upload = LocalBlob.upload_from_string
+
+    def flaky_upload(self, data, **kwargs):
+        if self.name.endswith(".part03"):
+            raise IOError("upload interrotto")
+        return upload(self, data, **kwargs)
+
+    monkeypatch.setattr(LocalBlob, "upload_from_string", flaky_upload)
+    with pytest.raises(IOError):
+        manager.stage(path)
+    manager.shutdown()
+
+    assert blob_names(manager) == []
+
+
+def test_blob_close_to_lifecycle_expiry_is_uploaded_again(tmp_path):
+    client = LocalStorageClient(str(tmp_path / "gcs"))
+    manager = GCSStagingManager("bucket", client=client, cleanup="lifecycle", lifecycle_days=1)
+    path, _ = write_file(tmp_path / "a.wav", 100)
+    staged = manager.stage(path)
+    assert manager.stage(path).reused
+
+    blob_path = tmp_path / "gcs" / "bucket" / staged.blob_name
+    old = time.time() - 23 * 60 * 60
+    os.utime(blob_path, (old, old))
+    assert not manager.stage(path).reused
+    assert os.path.getmtime(blob_path) > old
+    manager.shutdown()
+
+
+def test_delete_runs_outside_the_lock(manager, tmp_path, monkeypatch):
+    path, _ = write_file(tmp_path / "a.wav", 100)
+    staged = manager.stage(path)
+    delete = LocalBlob.delete
+    locked = []
+
+    def checked_delete(self, **kwargs):
+        locked.append(manager._lock.locked())
+        return delete(self, **kwargs)
+
+    monkeypatch.setattr(LocalBlob, "delete", checked_delete)
+    manager.release(staged).result()
+    assert locked == [False]
+    assert blob_names(manager) == []
@@ -0,0 +1,40 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import _split_document
+
+
+def check_chunks(text, chunks, max_bytes):
+    assert "".join(chunk for _, chunk in chunks) == text
+    for offset, chunk in chunks:
+        assert text[offset:offset + len(chunk)] == chunk
+        assert len(chunk.encode("utf-8")) <= max_bytes
+
+
+def test_keeps_sentences_together():
+    text = "Prima frase. Seconda frase. Terza."
+    chunks = _split_document(text, 30)
+    check_chunks(text, chunks, 30)
+    assert [chunk for _, chunk in chunks] == ["Prima frase. Seconda frase. ", "Terza."]
+
+
+def test_hard_splits_sentence_without_spaces():
+    chunks = _split_document("a" * 50, 10)
+    check_chunks("a" * 50, chunks, 10)
+    assert len(chunks) == 5
+
+
+def test_hard_splits_long_sentence_on_whitespace():
+    text = "Ciao. " + "parola lunghissima " * 5 + "è però così. Fine."
+    chunks = _split_document(text, 20)
+    check_chunks(text, chunks, 20)
+    assert all(chunk.endswith((" ", ".")) for _, chunk in chunks)
+
+
+def test_never_cuts_multibyte_characters():
+    text = "è" * 9
+    chunks = _split_document(text, 4)
+    check_chunks(text, chunks, 4)
+    assert [chunk for _, chunk in chunks] == ["èè"] * 4 + ["è"]
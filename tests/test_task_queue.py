@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from task_queue import FairTaskExecutor, QueueSaturatedError, STATUS_QUEUED, STATUS_RUNNING, STATUS_DONE
+
+
+@pytest.fixture
+def make_executor():
+    executors = []
+
+    def make(**kwargs):
+        executor = FairTaskExecutor(**kwargs)
+        executors.append(executor)
+        return executor
+
+    yield make
+    for executor in executors:
+        executor.shutdown()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timeout"
+        time.sleep(0.01)
+
+
+def block(executor, api="language"):
+    """Occupa un worker finché l'evento restituito non viene impostato"""
+    release = threading.Event()
+    task_id = executor.submit("blocker", api, release.wait)
+    wait_for(lambda: executor.poll(task_id).status == STATUS_RUNNING)
+    return release, task_id
+
+
+def test_sessions_are_served_round_robin(make_executor):
+    executor = make_executor(max_workers=1, max_queued_per_session=5)
+    release, _ = block(executor)
+    order = []
+    tasks = [executor.submit("A", "language", order.append, f"A{i}") for i in range(3)]
+    tasks += [executor.submit("B", "language", order.append, f"B{i}") for i in range(2)]
+    release.set()
+    wait_for(lambda: all(executor.poll(task).finished for task in tasks))
+    assert order == ["A0", "B0", "A1", "B1", "A2"]
+
+
+def test_api_limit_does_not_block_other_apis(make_executor):
+    executor = make_executor(max_workers=4, api_limits={"speech": 1})
+    release, _ = block(executor, api="speech")
+    speech = executor.submit("A", "speech", lambda: "speech")
+    language = executor.submit("B", "language", lambda: "language")
+    wait_for(lambda: executor.poll(language).status == STATUS_DONE)
+    assert executor.poll(speech).status == STATUS_QUEUED
+    assert executor.queue_depth()["running_by_api"] == {"speech": 1}
+
+    release.set()
+    wait_for(lambda: executor.poll(speech).status == STATUS_DONE)
+    assert executor.poll(speech).result == "speech"
+
+
+def test_full_queues_reject_requests(make_executor):
+    executor = make_executor(max_workers=1, max_queued=3, max_queued_per_session=2)
+    release, _ = block(executor)
+    executor.submit("A", "language", time.sleep, 0)
+    executor.submit("A", "language", time.sleep, 0)
+    with pytest.raises(QueueSaturatedError):
+        executor.submit("A", "language", time.sleep, 0)
+    executor.submit("B", "language", time.sleep, 0)
+    with pytest.raises(QueueSaturatedError):
+        executor.submit("C", "language", time.sleep, 0)
+    release.set()
+
+
+def test_position_counts_requests_of_all_sessions(make_executor):
+    executor = make_executor(max_workers=1, max_queued_per_session=5)
+    release, running = block(executor)
+    a = [executor.submit("A", "language", time.sleep, 0) for _ in range(3)]
+    b = [executor.submit("B", "language", time.sleep, 0) for _ in range(2)]
+    assert [executor.position(task) for task in a] == [0, 2, 4]
+    assert [executor.position(task) for task in b] == [1, 3]
+    assert executor.position(running) == 0
+    release.set()
+
+
+def test_shutdown_stops_the_dispatcher(make_executor):
+    executor = make_executor(max_workers=1)
+    task = executor.submit("A", "language", lambda: 42)
+    wait_for(lambda: executor.poll(task).finished)
+    executor.shutdown()
+    assert not executor._dispatcher.is_alive()
+    with pytest.raises(RuntimeError):
+        executor.submit("A", "language", lambda: 42)
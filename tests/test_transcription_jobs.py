@@ -0,0 +1,120 @@
+import os
+import sys
+import types
+
+import pytest
+from google.cloud import speech_v1 as speech
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import transcription_jobs
+from history import HistoryStore
+from job_store import JobStore, STATUS_RUNNING, STATUS_DONE
+from transcription_jobs import TranscriptionJobManager
+
+
+class FakeSpeechClient:
+    """Operazioni finte: done contiene i nomi delle operazioni completate"""
+
+    def __init__(self, transcript="che bello restare bloccati nel traffico"):
+        self.done = set()
+        response = speech.LongRunningRecognizeResponse(
+            results=[{"alternatives": [{"transcript": transcript, "confidence": 0.9}]}]
+        )
+        self._value = speech.LongRunningRecognizeResponse.serialize(response)
+
+    def get_operation(self, request):
+        return types.SimpleNamespace(done=request["name"] in self.done, HasField=lambda field: False,
+                                     response=types.SimpleNamespace(value=self._value))
+
+
+class FakeStaging:
+    def __init__(self):
+        self.released = []
+
+    def release(self, staged, delete=True):
+        self.released.append((staged.blob_name, delete))
+
+
+@pytest.fixture
+def staging(monkeypatch):
+    staging = FakeStaging()
+    monkeypatch.setattr(transcription_jobs, "get_staging_manager", lambda: staging)
+    return staging
+
+
+def create_job(store, operation_name, blob_name="audio/abc.wav"):
+    payload = {"audio_path": "test.wav", "language_code": "it-IT", "blob_name": blob_name,
+               "uri": f"gs://bucket/{blob_name}", "note": "Audio mono", "duration": 3.0,
+               "original_duration": 4.0, "input_hash": "abc", "source": "cli"}
+    return store.create(TranscriptionJobManager.KIND, operation_name, payload)
+
+
+def test_running_job_is_completed_after_restart(tmp_path, staging):
+    db_path = str(tmp_path / "jobs.db")
+    store = JobStore(db_path)
+    job_id = create_job(store, "op-1")
+    store.close()
+
+    # Nuovo processo: nuovo JobStore sullo stesso database
+    client = FakeSpeechClient()
+    manager = TranscriptionJobManager(JobStore(db_path), client)
+    assert manager.poll_once() == 0
+    assert manager.status(job_id) == STATUS_RUNNING
+
+    client.done.add("op-1")
+    assert manager.poll_once() == 1
+    assert manager.status(job_id) == STATUS_DONE
+    assert manager.result(job_id)["transcript"] == "che bello restare bloccati nel traffico"
+    assert staging.released == [("audio/abc.wav", True)]
+
+
+def test_job_is_closed_by_a_single_poller(tmp_path, staging):
+    db_path = str(tmp_path / "jobs.db")
+    history = HistoryStore(str(tmp_path / "history.db"))
+    client = FakeSpeechClient()
+    first = TranscriptionJobManager(JobStore(db_path), client, history=history)
+    second = TranscriptionJobManager(JobStore(db_path), client, history=history)
+    job_id = create_job(first.store, "op-1")
+    client.done.add("op-1")
+
+    # Il secondo poller ha già letto il job come in corso
+    stale = second.store.running(TranscriptionJobManager.KIND)
+    assert first.poll_once() == 1
+    assert not second.store.finish(stale[0]["job_id"], STATUS_DONE, {})
+    assert second.poll_once() == 0
+    assert history.summary("audio")["runs"] == 1
+    assert len(staging.released) == 1
+    assert first.status(job_id) == STATUS_DONE
+
+
+def test_blob_shared_with_a_running_job_is_not_deleted(tmp_path, staging):
+    client = FakeSpeechClient()
+    manager = TranscriptionJobManager(JobStore(str(tmp_path / "jobs.db")), client)
+    create_job(manager.store, "op-1")
+    create_job(manager.store, "op-2")
+    client.done.add("op-1")
+
+    assert manager.poll_once() == 1
+    assert staging.released == [("audio/abc.wav", False)]
+    client.done.add("op-2")
+    assert manager.poll_once() == 1
+    assert staging.released[-1] == ("audio/abc.wav", True)
+
+
+def test_transcript_sentiment_updates_the_recorded_run(tmp_path, staging):
+    history = HistoryStore(str(tmp_path / "history.db"))
+    client = FakeSpeechClient()
+    manager = TranscriptionJobManager(JobStore(str(tmp_path / "jobs.db")), client, history=history)
+    job_id = create_job(manager.store, "op-1")
+    client.done.add("op-1")
+    manager.poll_once()
+    assert history.summary("audio")["scored"] == 0
+
+    sentiment = {"score": 0.6, "magnitude": 1.2, "sarcasm_detected": True, "irony_hits": 2}
+    assert manager.record_sentiment(job_id, sentiment)
+    assert not manager.record_sentiment(job_id, sentiment)
+    summary = history.summary("audio")
+    assert summary["scored"] == 1
+    assert summary["avg_score"] == pytest.approx(0.6)
+    assert summary["irony_rate"] == 1.0
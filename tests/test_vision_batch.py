@@ -0,0 +1,113 @@
+import os
+import sys
+import json
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gcs_staging import GCSStagingManager
+from job_store import JobStore, STATUS_RUNNING, STATUS_DONE
+from local_storage import LocalStorageClient
+from vision_batch import VisionBatchJobManager, IMAGE_PREFIX
+
+BUCKET = "bucket"
+
+
+class FakeVisionClient:
+    """
+    Annota ogni immagine con un volto sorridente; l'output viene scritto nel
+    bucket locale quando l'operazione risulta completata.
+    """
+
+    def __init__(self, storage, fail_calls=()):
+        self.storage = storage
+        self.fail_calls = set(fail_calls)
+        self.calls = 0
+        self.operations = {}
+
+    def async_batch_annotate_images(self, requests, output_config):
+        self.calls += 1
+        if self.calls in self.fail_calls:
+            raise RuntimeError("quota esaurita")
+        name = f"operations/{len(self.operations)}"
+        prefix = output_config.gcs_destination.uri[len(f"gs://{BUCKET}/"):]
+        responses = [{"context": {"uri": request.image.source.image_uri},
+                      "faceAnnotations": [{"joyLikelihood": "VERY_LIKELY", "detectionConfidence": 0.8}]}
+                     for request in requests]
+        self.operations[name] = (prefix, responses)
+        return types.SimpleNamespace(operation=types.SimpleNamespace(name=name))
+
+    def get_operation(self, request):
+        prefix, responses = self.operations[request["name"]]
+        blob = self.storage.bucket(BUCKET).blob(f"{prefix}output-1-to-{len(responses)}.json")
+        blob.upload_from_string(json.dumps({"responses": responses}))
+        return types.SimpleNamespace(done=True, HasField=lambda field: False)
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return LocalStorageClient(str(tmp_path / "gcs"))
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for i in range(5):
+        path = tmp_path / f"img{i}.jpg"
+        # img0 e img4 hanno lo stesso contenuto e condividono il blob
+        path.write_bytes(b"immagine %d" % (i % 4))
+        paths.append(str(path))
+    return paths
+
+
+def make_manager(tmp_path, storage, client):
+    staging = GCSStagingManager(BUCKET, client=storage, prefix=IMAGE_PREFIX, cleanup="lifecycle")
+    return VisionBatchJobManager(JobStore(str(tmp_path / "jobs.db")), client, staging, batch_size=2)
+
+
+def test_submit_poll_and_results(tmp_path, storage, images):
+    manager = make_manager(tmp_path, storage, FakeVisionClient(storage))
+    job_id = manager.submit(images)
+    assert manager.progress(job_id)["submitted"] == 3
+
+    assert manager.poll_once() == 1
+    progress = manager.progress(job_id)
+    assert (progress["status"], progress["completed"], progress["failed"]) == (STATUS_DONE, 3, 0)
+
+    # I risultati sono ricondotti alle immagini senza rileggere i file locali
+    for path in images:
+        os.remove(path)
+    results = manager.results(job_id)
+    assert list(results) == images
+    assert all(result["joy"] == "VERY_LIKELY" for result in results.values())
+
+    rules = manager.staging.bucket.lifecycle_rules
+    assert [rule["condition"]["matchesPrefix"] for rule in rules] == [[f"{IMAGE_PREFIX}/"]]
+
+
+def test_failed_chunk_is_resumed_from_a_fresh_store(tmp_path, storage, images):
+    manager = make_manager(tmp_path, storage, FakeVisionClient(storage, fail_calls={2}))
+    job_id = manager.submit(images)
+    manager.poll_once()
+    progress = manager.progress(job_id)
+    assert (progress["completed"], progress["failed"]) == (2, 1)
+    assert manager.results(job_id)[images[2]] == {"error": "quota esaurita"}
+
+    # Nuovo processo: stesso database, nuovo client
+    resumed = make_manager(tmp_path, storage, FakeVisionClient(storage))
+    assert resumed.resume(job_id, retry_failed=True) == 1
+    assert resumed.progress(job_id)["status"] == STATUS_RUNNING
+    assert resumed.poll_once() == 1
+    results = resumed.results(job_id)
+    assert all("error" not in result for result in results.values())
+
+
+def test_missing_outputs_raise(tmp_path, storage, images):
+    manager = make_manager(tmp_path, storage, FakeVisionClient(storage))
+    job_id = manager.submit(images)
+    manager.poll_once()
+    manager.delete_outputs(job_id)
+    with pytest.raises(FileNotFoundError):
+        manager.results(job_id)
@@ -0,0 +1,169 @@
+import time
+import threading
+
+from google.cloud import speech_v1 as speech
+
+from audio_levels import MAX_PAUSE_SECONDS
+from gcs_staging import StagedBlob, file_digest, get_staging_manager
+from job_store import JobStore, get_operation, STATUS_DONE, STATUS_ERROR
+from main import (_prepare_audio, _cleanup_prepared_audio, _silent_audio_result,
+                  start_transcription, build_transcription_result)
+
+
+class TranscriptionJobManager:
+    """
+    Trascrizioni non bloccanti: submit() carica l'audio, avvia l'operazione e
+    restituisce subito un job id; un unico thread di polling raccoglie le
+    operazioni completate, per cui molti job possono essere in corso da un
+    solo processo. I job in corso vengono ripresi anche dopo un riavvio.
+    """
+
+    KIND = "transcription"
+
+    def __init__(self, store=None, client=None, poll_interval=10, history=None, source="cli"):
+        self.store = store or JobStore()
+        self.poll_interval = poll_interval
+        # Se presente (history.HistoryStore), ogni trascrizione completata viene salvata nello storico
+        self.history = history
+        self.source = source
+        self._client = client
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = speech.SpeechClient()
+        return self._client
+
+    def submit(self, audio_path, language_code="it-IT", max_pause=MAX_PAUSE_SECONDS):
+        """Avvia la trascrizione senza attenderne la fine e restituisce il job id"""
+        if not audio_path.lower().endswith('.wav'):
+            raise ValueError("Il file deve essere in formato WAV per l'analisi")
+
+        prepared = _prepare_audio(audio_path, max_pause)
+        input_hash = file_digest(audio_path) if self.history is not None else None
+        if prepared["silent"]:
+            # Nessuna operazione da avviare: il job nasce già completato
+            payload = {"audio_path": audio_path, "language_code": language_code,
+                       "input_hash": input_hash, "source": self.source}
+            result = _silent_audio_result(prepared)
+            job_id = self.store.create(self.KIND, None, payload, STATUS_DONE, result)
+            self._record_history(payload, result, time.time())
+            return job_id
+
+        try:
+            operation, staged = start_transcription(prepared, language_code, client=self.client)
+        finally:
+            _cleanup_prepared_audio(prepared)
+
+        payload = {
+            "audio_path": audio_path,
+            "language_code": language_code,
+            "blob_name": staged.blob_name,
+            "uri": staged.uri,
+            "note": prepared["note"],
+            "duration": prepared["duration"],
+            "original_duration": prepared["original_duration"],
+            "input_hash": input_hash,
+            "source": self.source
+        }
+        job_id = self.store.create(self.KIND, operation.operation.name, payload)
+        print(f"📨 Trascrizione avviata, job {job_id}")
+        return job_id
+
+    def poll_once(self):
+        """Controlla tutti i job in corso e salva quelli completati. Restituisce quanti ne ha chiusi"""
+        completed = 0
+        for job in self.store.running(self.KIND):
+            try:
+                operation = get_operation(self.client, job["operation_name"])
+            except Exception as e:
+                print(f"⚠️ Impossibile controllare il job {job['job_id']}: {e}")
+                continue
+            if not operation.done:
+                continue
+
+            payload = job["payload"]
+            if operation.HasField("error"):
+                status, result = STATUS_ERROR, {"error": operation.error.message}
+            else:
+                response = speech.LongRunningRecognizeResponse.deserialize(operation.response.value)
+                status, result = STATUS_DONE, build_transcription_result(
+                    response, payload["note"], payload["duration"], payload.get("original_duration")
+                )
+            if not self.store.finish(job["job_id"], status, result):
+                # Chiuso nel frattempo da un altro poller, che ha già salvato storico e blob
+                continue
+            run_id = self._record_history(payload, result, job["created_at"])
+            if run_id is not None:
+                # Il sentiment della trascrizione arriva dopo: record_sentiment() aggiorna questa esecuzione
+                self.store.update(job["job_id"], status, {**result, "history_run_id": run_id})
+
+            # Il file su GCS non serve più, a meno che un altro job in corso (anche avviato
+            # da un altro processo, con refcount separati) stia trascrivendo lo stesso audio
+            in_use = any(other["payload"].get("blob_name") == payload["blob_name"]
+                         for other in self.store.running(self.KIND))
+            staged = StagedBlob(payload["blob_name"], payload["uri"], False)
+            get_staging_manager().release(staged, delete=not in_use)
+            completed += 1
+        return completed
+
+    def _record_history(self, payload, result, started_at):
+        """Salva il job completato nello storico e restituisce l'id dell'esecuzione, o None"""
+        # Solo i job avviati con lo storico attivo hanno l'hash dell'input
+        if self.history is None or not payload.get("input_hash"):
+            return None
+        try:
+            return self.history.record("audio", payload["input_hash"], result, payload.get("source", self.source),
+                                       started_at=started_at)
+        except Exception as e:
+            print(f"⚠️ Impossibile aggiornare lo storico: {e}")
+            return None
+
+    def record_sentiment(self, job_id, sentiment):
+        """
+        Aggiunge all'esecuzione salvata nello storico per il job il sentiment della
+        trascrizione. Restituisce True se lo storico è stato aggiornato.
+        """
+        if self.history is None or "error" in sentiment:
+            return False
+        job = self.store.get(job_id)
+        run_id = (job["result"] or {}).get("history_run_id") if job else None
+        if run_id is None:
+            return False
+        try:
+            return self.history.record_sentiment(run_id, sentiment)
+        except Exception as e:
+            print(f"⚠️ Impossibile aggiornare lo storico: {e}")
+            return False
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.poll_once()
+            self._stop.wait(self.poll_interval)
+
+    def start(self):
+        """Avvia il thread di polling in background (una sola volta)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="transcription-poller", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def status(self, job_id):
+        """Restituisce lo stato del job ('running', 'done', 'error') o None se sconosciuto"""
+        job = self.store.get(job_id)
+        return job["status"] if job else None
+
+    def result(self, job_id):
+        """Restituisce il dizionario dei risultati se il job è terminato, altrimenti None"""
+        job = self.store.get(job_id)
+        if job is None:
+            return {"error": f"Job {job_id} non trovato"}
+        return job["result"]
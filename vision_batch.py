@@ -0,0 +1,352 @@
+import os
+import re
+import json
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from google.cloud import vision_v1 as vision
+
+from gcs_staging import DEFAULT_BUCKET, GCSStagingManager
+from job_store import JobStore, get_operation, STATUS_RUNNING, STATUS_DONE, STATUS_ERROR
+
+# Analisi dei volti in modalità batch offline per insiemi molto grandi di
+# immagini: le immagini vengono caricate su GCS e annotate da Vision con
+# async_batch_annotate_images, che scrive i risultati in file JSON su GCS.
+# Il job è diviso in blocchi, ognuno con la propria operazione; l'avanzamento
+# è salvato blocco per blocco nel JobStore, così un job interrotto riprende dai
+# blocchi mancanti.
+
+# Limite di Vision sul numero di immagini per richiesta asincrona
+BATCH_SIZE = 2000
+
+# Risposte per file JSON di output (output-1-to-100.json, ...)
+OUTPUT_BATCH_SIZE = 100
+
+IMAGE_PREFIX = "images"
+OUTPUT_PREFIX = "vision_output"
+
+SHARD_PATTERN = re.compile(r"output-(\d+)-to-(\d+)\.json$")
+
+EMOTIONS = ("joy", "sorrow", "anger", "surprise")
+
+
+def face_result_from_json(response):
+    """
+    Converte una risposta JSON di Vision (chiavi camelCase, likelihood come stringhe)
+    nello stesso dizionario restituito da main.analyze_face_expression.
+    """
+    if "error" in response:
+        return {"error": response["error"].get("message", "Errore di Vision")}
+    faces = response.get("faceAnnotations")
+    if not faces:
+        return {"error": "Nessun volto rilevato"}
+    face = faces[0]  # Prende il primo volto rilevato
+    result = {emotion: face.get(f"{emotion}Likelihood", "UNKNOWN") for emotion in EMOTIONS}
+    result["detection_confidence"] = face.get("detectionConfidence", 0.0)
+    return result
+
+
+def iter_output_responses(bucket, prefix):
+    """
+    Legge i file JSON di output sotto prefix uno alla volta, in ordine, e
+    restituisce le singole risposte senza tenere in memoria l'intero output.
+    Solleva FileNotFoundError se sotto prefix non c'è alcun file di output.
+    """
+    shards = []
+    for blob in bucket.list_blobs(prefix=prefix):
+        match = SHARD_PATTERN.search(blob.name)
+        if match:
+            shards.append((int(match.group(1)), blob))
+    if not shards:
+        raise FileNotFoundError(f"Nessun file di output di Vision in gs://{bucket.name}/{prefix}")
+    for _, blob in sorted(shards, key=lambda shard: shard[0]):
+        for response in json.loads(blob.download_as_bytes()).get("responses", []):
+            yield response
+
+
+class VisionBatchJobManager:
+    """
+    Job di annotazione dei volti su grandi insiemi di immagini.
+
+    submit() registra il job e avvia i blocchi; poll_once() controlla le
+    operazioni in corso e avvia i blocchi non ancora inviati (ad esempio dopo
+    un'interruzione); iter_results() legge i risultati da GCS immagine per immagine.
+    """
+
+    KIND = "vision_batch"
+
+    def __init__(self, store=None, client=None, staging=None, bucket_name=DEFAULT_BUCKET,
+                 batch_size=BATCH_SIZE, max_workers=8, poll_interval=30):
+        self.store = store or JobStore()
+        # Il job può essere controllato da un processo diverso da quello che ha caricato
+        # le immagini, che non ne conosce i riferimenti: le elimina la regola del bucket,
+        # limitata al prefisso delle immagini (gli output sotto OUTPUT_PREFIX restano)
+        self.staging = staging or GCSStagingManager(bucket_name, prefix=IMAGE_PREFIX, cleanup="lifecycle")
+        if self.staging.cleanup != "lifecycle":
+            raise ValueError("I job batch richiedono un GCSStagingManager con cleanup='lifecycle'")
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self._client = client
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = vision.ImageAnnotatorClient()
+        return self._client
+
+    def submit(self, image_paths):
+        """Registra il job, avvia i blocchi e restituisce il job id"""
+        image_paths = [os.path.abspath(path) for path in image_paths]
+        payload = {"images": image_paths, "batch_size": self.batch_size}
+        job_id = self.store.create(self.KIND, None, payload)
+        print(f"📨 Job batch {job_id}: {len(image_paths)} immagini in "
+              f"{self._chunk_count(payload)} blocchi")
+        self.resume(job_id)
+        return job_id
+
+    @staticmethod
+    def _chunk_count(payload):
+        return -(-len(payload["images"]) // payload["batch_size"])
+
+    def _chunk_paths(self, payload, index):
+        start = index * payload["batch_size"]
+        return payload["images"][start:start + payload["batch_size"]]
+
+    def _output_prefix(self, job_id, index):
+        return f"{OUTPUT_PREFIX}/{job_id}/{index:05d}/"
+
+    def resume(self, job_id, retry_failed=False):
+        """
+        Avvia i blocchi del job non ancora inviati (con retry_failed=True anche quelli
+        falliti) e restituisce quanti ne ha avviati.
+        """
+        with self._lock:
+            job = self.store.get(job_id)
+            if job is None or (job["status"] != STATUS_RUNNING and not retry_failed):
+                return 0
+            payload = job["payload"]
+            chunks = {chunk["chunk_index"]: chunk for chunk in self.store.chunks(job_id)}
+            started = 0
+            for index in range(self._chunk_count(payload)):
+                chunk = chunks.get(index)
+                if chunk is not None and not (retry_failed and chunk["status"] == STATUS_ERROR):
+                    continue
+                # Checkpoint dopo ogni blocco: un'interruzione non ripete i blocchi già avviati
+                self.store.save_chunk(job_id, index, **self._start_chunk(job_id, index, self._chunk_paths(payload, index)))
+                started += 1
+            if started and job["status"] != STATUS_RUNNING:
+                self.store.update(job_id, STATUS_RUNNING)
+            return started
+
+    def _start_chunk(self, job_id, index, paths):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.staging.stage, path) for path in paths]
+        failed = [future.exception() for future in futures if future.exception()]
+        if failed:
+            # Le immagini caricate prima dell'errore non servono più
+            for future in futures:
+                if not future.exception():
+                    self.staging.release(future.result())
+            print(f"❌ Errore nel caricamento del blocco {index}: {failed[0]}")
+            return {"status": STATUS_ERROR, "error": str(failed[0])}
+        staged = [future.result() for future in futures]
+
+        feature = vision.Feature(type_=vision.Feature.Type.FACE_DETECTION)
+        requests = [
+            vision.AnnotateImageRequest(
+                image=vision.Image(source=vision.ImageSource(image_uri=blob.uri)),
+                features=[feature]
+            )
+            for blob in staged
+        ]
+        output_prefix = self._output_prefix(job_id, index)
+        output_config = vision.OutputConfig(
+            gcs_destination=vision.GcsDestination(uri=self.staging.uri_for(output_prefix)),
+            batch_size=OUTPUT_BATCH_SIZE
+        )
+        try:
+            operation = self.client.async_batch_annotate_images(requests=requests, output_config=output_config)
+        except Exception as e:
+            print(f"❌ Errore nell'avvio del blocco {index}: {e}")
+            return {"status": STATUS_ERROR, "error": str(e)}
+        finally:
+            # Libera solo i riferimenti locali: i blob restano fino alla regola di lifecycle
+            for blob in staged:
+                self.staging.release(blob)
+
+        print(f"🔄 Blocco {index} avviato ({len(paths)} immagini)")
+        # Gli URI servono a ricondurre le risposte alle immagini senza rileggere i file
+        return {"status": STATUS_RUNNING, "operation_name": operation.operation.name,
+                "output_prefix": output_prefix, "items": [blob.uri for blob in staged]}
+
+    def poll_once(self):
+        """
+        Controlla le operazioni in corso, avvia i blocchi mancanti e chiude i job
+        completati. Restituisce il numero di job chiusi.
+        """
+        completed = 0
+        with self._lock:
+            for job in self.store.running(self.KIND):
+                job_id = job["job_id"]
+                self.resume(job_id)
+                for chunk in self.store.chunks(job_id, STATUS_RUNNING):
+                    index = chunk["chunk_index"]
+                    try:
+                        operation = get_operation(self.client, chunk["operation_name"])
+                    except Exception as e:
+                        print(f"⚠️ Impossibile controllare il blocco {index} del job {job_id}: {e}")
+                        continue
+                    if not operation.done:
+                        continue
+                    error = operation.error.message if operation.HasField("error") else None
+                    self.store.save_chunk(job_id, index, STATUS_ERROR if error else STATUS_DONE,
+                                          chunk["operation_name"], chunk["output_prefix"], error)
+
+                statuses = [chunk["status"] for chunk in self.store.chunks(job_id)]
+                if len(statuses) == self._chunk_count(job["payload"]) and STATUS_RUNNING not in statuses:
+                    status = STATUS_DONE if STATUS_DONE in statuses or not statuses else STATUS_ERROR
+                    if self.store.finish(job_id, status):
+                        completed += 1
+        return completed
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.poll_once()
+            self._stop.wait(self.poll_interval)
+
+    def start(self):
+        """Avvia il thread di polling in background (una sola volta)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="vision-batch-poller", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def progress(self, job_id):
+        """Stato del job e numero di blocchi inviati, completati e falliti, o None se sconosciuto"""
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        chunks = self.store.chunks(job_id)
+        statuses = [chunk["status"] for chunk in chunks]
+        return {
+            "status": job["status"],
+            "images": len(job["payload"]["images"]),
+            "chunks": self._chunk_count(job["payload"]),
+            "submitted": sum(chunk["operation_name"] is not None for chunk in chunks),
+            "completed": statuses.count(STATUS_DONE),
+            "failed": statuses.count(STATUS_ERROR)
+        }
+
+    def iter_results(self, job_id):
+        """
+        Restituisce coppie (percorso immagine, risultato) per i blocchi terminati,
+        leggendo i file di output un blocco alla volta. I risultati hanno lo stesso
+        formato di main.analyze_face_expression. Solleva FileNotFoundError se i file
+        di output di un blocco completato non esistono (ad esempio perché eliminati).
+        """
+        job = self.store.get(job_id)
+        if job is None:
+            return
+        payload = job["payload"]
+        for chunk in self.store.chunks(job_id):
+            paths = self._chunk_paths(payload, chunk["chunk_index"])
+            if chunk["status"] == STATUS_ERROR:
+                for path in paths:
+                    yield path, {"error": chunk["error"]}
+                continue
+            if chunk["status"] != STATUS_DONE:
+                continue
+
+            # Immagini identiche condividono lo stesso blob (e quindi la stessa risposta)
+            pending = {}
+            for path, uri in zip(paths, self.store.chunk_items(job_id, chunk["chunk_index"])):
+                pending.setdefault(uri, []).append(path)
+            for response in iter_output_responses(self.staging.bucket, chunk["output_prefix"]):
+                uri = response.get("context", {}).get("uri")
+                result = face_result_from_json(response)
+                for path in pending.pop(uri, []):
+                    yield path, result
+            for missing in pending.values():
+                for path in missing:
+                    yield path, {"error": "Risultato mancante nell'output di Vision"}
+
+    def results(self, job_id):
+        """Risultati dei blocchi terminati come dizionario {percorso immagine: risultato}"""
+        return dict(self.iter_results(job_id))
+
+    def delete_outputs(self, job_id):
+        """Elimina da GCS i file di output del job"""
+        for blob in self.staging.bucket.list_blobs(prefix=f"{OUTPUT_PREFIX}/{job_id}/"):
+            blob.delete()
+
+
+def _list_images(sources):
+    """Espande file e directory in un elenco di immagini"""
+    extensions = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp")
+    images = []
+    for source in sources:
+        if os.path.isdir(source):
+            for dirpath, _, filenames in os.walk(source):
+                images.extend(os.path.join(dirpath, name) for name in sorted(filenames)
+                              if name.lower().endswith(extensions))
+        else:
+            images.append(source)
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analisi dei volti in batch offline con Vision")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    submit_parser = subparsers.add_parser("submit", help="Avvia un job su file o directory di immagini")
+    submit_parser.add_argument("sources", nargs="+", help="Immagini o directory da analizzare")
+    status_parser = subparsers.add_parser("status", help="Aggiorna e mostra l'avanzamento di un job")
+    status_parser.add_argument("job_id")
+    resume_parser = subparsers.add_parser("resume", help="Riprende un job, ripetendo i blocchi falliti")
+    resume_parser.add_argument("job_id")
+    results_parser = subparsers.add_parser("results", help="Scrive i risultati di un job in formato JSON Lines")
+    results_parser.add_argument("job_id")
+    results_parser.add_argument("--output", default="-", help="File di destinazione (default: stdout)")
+    args = parser.parse_args()
+
+    manager = VisionBatchJobManager()
+    if args.command == "submit":
+        job_id = manager.submit(_list_images(args.sources))
+        print(f"✅ Job avviato: {job_id}")
+    elif args.command == "resume":
+        started = manager.resume(args.job_id, retry_failed=True)
+        print(f"🔄 Job {args.job_id}: {started} blocchi riavviati")
+    elif args.command == "status":
+        manager.poll_once()
+        progress = manager.progress(args.job_id)
+        if progress is None:
+            print(f"❌ Job {args.job_id} non trovato")
+        else:
+            print(f"📊 Job {args.job_id}: {progress['status']}, {progress['images']} immagini, "
+                  f"blocchi {progress['completed']}/{progress['chunks']} completati, {progress['failed']} falliti")
+    else:
+        out = open(args.output, "w") if args.output != "-" else None
+        try:
+            for path, result in manager.iter_results(args.job_id):
+                line = json.dumps({"image": path, **result})
+                if out:
+                    out.write(line + "\n")
+                else:
+                    print(line)
+        finally:
+            if out:
+                out.close()
+
+
+if __name__ == "__main__":
+    main()